@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+On-disk cache of parsed, normalized embeddings shared by the analysis scripts.
+
+Entries are a `<prefix>_<key>.npy` array plus `<prefix>_<key>.json` metadata,
+keyed on the database state so a changed library invalidates them.
+"""
+
+import hashlib
+import json
+import os
+import numpy as np
+from pathlib import Path
+
+# Parsed, normalized embeddings are cached here, keyed on the database state
+CACHE_DIR = Path.home() / ".cache" / "navidrome_radio"
+
+
+def db_state_key(conn):
+    """Short hash of the embedding tables' state, used to key the on-disk cache."""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT count(*), max(te.computed_at), max(li.last_synced)
+        FROM track_embeddings te
+        JOIN library_index li ON te.track_id = li.id
+    """)
+    state = cur.fetchone()
+    cur.close()
+    return hashlib.sha1(repr(state).encode()).hexdigest()[:16]
+
+
+def cache_paths(prefix, key):
+    """The (embeddings .npy, metadata .json) paths of a cache entry."""
+    return CACHE_DIR / f"{prefix}_{key}.npy", CACHE_DIR / f"{prefix}_{key}.json"
+
+
+def load_cache(prefix, key):
+    """(metadata, read-only memmapped embeddings) for the entry, or None if missing."""
+    emb_path, meta_path = cache_paths(prefix, key)
+    if not (meta_path.exists() and emb_path.exists()):
+        return None
+    with open(meta_path) as f:
+        meta = json.load(f)
+    return meta, np.load(emb_path, mmap_mode='r')
+
+
+def save_cache(prefix, key, embeddings, meta):
+    """
+    Write the embeddings and metadata, the metadata last and atomically, then
+    delete the entries this prefix left for older database states.
+    """
+    emb_path, meta_path = cache_paths(prefix, key)
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    np.save(emb_path, embeddings)
+    with open(f"{meta_path}.tmp", "w") as f:
+        json.dump(meta, f)
+    os.replace(f"{meta_path}.tmp", meta_path)
+
+    for path in CACHE_DIR.glob(f"{prefix}_*"):
+        if path not in (emb_path, meta_path):
+            path.unlink(missing_ok=True)
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Mel spectrogram post-processing shared by the encoder test scripts.
+"""
+
+import numpy as np
+
+
+def power_to_unit_db(mel_spec, top_db: float = 80.0):
+    """
+    Convert a power mel spectrogram to dB (ref=max) normalized to [0, 1], in
+    place: (power_to_db(S, ref=np.max, top_db=top_db) + top_db) / top_db.
+
+    Same arithmetic as librosa.power_to_db; returns `mel_spec`, overwritten.
+    """
+    amin = 1e-10
+    ref_db = 10.0 * np.log10(np.maximum(amin, mel_spec.max()))
+    mel_db = np.maximum(mel_spec, amin, out=mel_spec)
+    np.log10(mel_db, out=mel_db)
+    mel_db *= 10.0
+    mel_db -= ref_db
+    np.maximum(mel_db, mel_db.max() - top_db, out=mel_db)
+
+    # Normalize to [0, 1]: (S + top_db) / top_db
+    mel_db += top_db
+    mel_db /= top_db
+    return mel_db
+
+
+def resize_frames(mel, target_frames: int = 216):
+    """
+    Resize a (n_mels, frames) spectrogram to `target_frames` frames by linear
+    interpolation along the frame axis, on the same grid and in the same f32
+    arithmetic as the backend's resize_spectrogram: target frame t samples
+    source position t * (frames / target_frames). Returns `mel` itself if no
+    resize is needed.
+    """
+    current_frames = mel.shape[1]
+    if current_frames == target_frames:
+        return mel
+
+    scale = np.float32(current_frames) / np.float32(target_frames)
+    src = np.arange(target_frames, dtype=np.float32) * scale
+    i0 = np.floor(src).astype(np.int32)
+    i1 = np.minimum(i0 + 1, current_frames - 1)
+    frac = src - i0.astype(np.float32)
+
+    # a * (1 - f) + b * f, on the gathered copies
+    resized = mel[:, i0]
+    resized *= 1.0 - frac
+    upper = mel[:, i1]
+    upper *= frac
+    resized += upper
+    return resized
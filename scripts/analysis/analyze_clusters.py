@@ -3,13 +3,17 @@
 Analyze embedding clusters to verify meaningful audio similarity.
 """
 
-import json
+import csv
+import io
 import numpy as np
 import psycopg2
-from collections import defaultdict
-from sklearn.cluster import KMeans
+import sys
+from collections import Counter
+from functools import lru_cache
+from sklearn.cluster import MiniBatchKMeans
 from sklearn.decomposition import PCA
 from sklearn.metrics import silhouette_score
+from scipy.linalg.blas import ssyrk
 from scipy.spatial.distance import cdist
 
 
@@ -24,82 +28,135 @@ def get_data():
     )
     cur = conn.cursor()
 
-    # Fetch embeddings with metadata
-    cur.execute("""
-        SELECT te.track_id, li.title, li.artist, li.album, li.genres,
-               te.embedding::text
-        FROM track_embeddings te
-        JOIN library_index li ON te.track_id = li.id
-    """)
+    # Stream embeddings with metadata as one CSV blob instead of per-cell adapters
+    buf = io.StringIO()
+    cur.copy_expert("""
+        COPY (
+            SELECT te.track_id, li.title, li.artist, li.album,
+                   COALESCE(li.genres->>0, 'Unknown'),
+                   te.embedding::text
+            FROM track_embeddings te
+            JOIN library_index li ON te.track_id = li.id
+        ) TO STDOUT WITH (FORMAT CSV)
+    """, buf)
 
-    rows = cur.fetchall()
     cur.close()
     conn.close()
 
-    tracks = []
-    embeddings = []
+    buf.seek(0)
+    rows = list(csv.reader(buf))
 
-    for row in rows:
-        track_id, title, artist, album, genres, emb_str = row
-        # Parse embedding from postgres vector format "[1,2,3,...]"
-        emb = np.array([float(x) for x in emb_str.strip('[]').split(',')])
+    # Parse every postgres vector "[1,2,3,...]" in a single C-level pass
+    embeddings = np.fromstring(
+        ','.join(row[5][1:-1] for row in rows), sep=',', dtype=np.float32
+    ).reshape(len(rows), -1)
 
-        tracks.append({
+    # Primary genre is extracted server-side, so no JSON parsing per row
+    tracks = [
+        {
             'id': track_id,
             'title': title,
             'artist': artist,
             'album': album,
-            'genres': genres if isinstance(genres, list) else json.loads(genres) if genres else [],
-            'primary_genre': (genres[0] if isinstance(genres, list) and genres
-                            else json.loads(genres)[0] if genres and json.loads(genres)
-                            else 'Unknown')
-        })
-        embeddings.append(emb)
-
-    return tracks, np.array(embeddings)
-
-
-def cosine_similarity(a, b):
-    """Compute cosine similarity between two vectors."""
-    return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b) + 1e-10)
-
-
-def analyze_same_artist(tracks, embeddings):
+            'primary_genre': primary_genre
+        }
+        for track_id, title, artist, album, primary_genre, _ in rows
+    ]
+
+    return tracks, embeddings
+
+
+def cosine_gram(embeddings, use_gpu=False):
+    """Cosine similarity matrix of L2-normalized embeddings, upper triangle only.
+
+    ssyrk fills just one triangle of E @ E.T (half the FLOPs of a GEMM);
+    the strict lower triangle is left as zeros, so read it via gram_pairs.
+    With use_gpu, the product runs as an FP16 tensor-core GEMM via torch,
+    falling back to the CPU when torch or a CUDA device is unavailable.
+    """
+    if use_gpu:
+        try:
+            import torch
+        except ImportError:
+            torch = None
+        if torch is not None and torch.cuda.is_available():
+            E = torch.from_numpy(embeddings).to('cuda', dtype=torch.float16)
+            return torch.triu(E @ E.T).float().cpu().numpy()
+        print("CUDA not available, computing similarities on CPU")
+    return ssyrk(1.0, embeddings)
+
+
+def gram_pairs(gram, i, j):
+    """Look up similarities for index arrays i, j in an upper-triangular gram."""
+    return gram[np.minimum(i, j), np.maximum(i, j)]
+
+
+@lru_cache(maxsize=None)
+def upper_triangle_pairs(n):
+    """Row-major (i, j) index arrays of all pairs i < j for a group of size n."""
+    return np.triu_indices(n, k=1)
+
+
+def group_indices(keys):
+    """Track indices grouped by key, in order of first appearance.
+
+    One stable argsort replaces a Python groupby pass; groups are then
+    reordered by their first index to match dict insertion order.
+    Returns (groups, group_keys).
+    """
+    keys = np.asarray(keys)
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+    groups = np.split(order, starts[1:])
+    first_seen = np.argsort(order[starts])
+    return [groups[k] for k in first_seen], sorted_keys[starts[first_seen]].tolist()
+
+
+def grouped_upper_sims(gram, groups, max_pairs=None):
+    """Pairwise similarities within each index group, gathered in one pass.
+
+    Returns the concatenated similarities and the offset of each group's
+    first pair; split on offsets[1:] to recover per-group arrays.
+    """
+    iu, ju, sizes = [], [], []
+    for indices in groups:
+        indices = np.asarray(indices)
+        i, j = upper_triangle_pairs(len(indices))
+        iu.append(indices[i[:max_pairs]])
+        ju.append(indices[j[:max_pairs]])
+        sizes.append(len(iu[-1]))
+
+    sims = gram_pairs(gram, np.concatenate(iu), np.concatenate(ju))
+    offsets = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    return sims, offsets
+
+
+def analyze_same_artist(tracks, gram):
     """Analyze similarity within same artist."""
     print("\n" + "="*70)
     print("SAME ARTIST ANALYSIS")
     print("="*70)
 
     # Group by artist
-    artist_tracks = defaultdict(list)
-    for i, track in enumerate(tracks):
-        artist_tracks[track['artist']].append(i)
+    artists = np.array([t['artist'] for t in tracks])
+    artist_groups, artist_names = group_indices(artists)
 
     # Only analyze artists with multiple tracks
-    multi_track_artists = {a: indices for a, indices in artist_tracks.items()
+    multi_track_artists = {a: indices for a, indices in zip(artist_names, artist_groups)
                           if len(indices) >= 2}
 
     print(f"Artists with 2+ tracks: {len(multi_track_artists)}")
 
-    intra_artist_sims = []
-    inter_artist_sims = []
-
-    for artist, indices in multi_track_artists.items():
-        embs = embeddings[indices]
-        # Compute pairwise similarities within artist
-        for i in range(len(indices)):
-            for j in range(i+1, len(indices)):
-                sim = cosine_similarity(embs[i], embs[j])
-                intra_artist_sims.append(sim)
+    # Compute pairwise similarities within each artist
+    intra_artist_sims, _ = grouped_upper_sims(gram, multi_track_artists.values())
 
-    # Sample inter-artist similarities
-    all_indices = list(range(len(tracks)))
-    np.random.seed(42)
-    for _ in range(min(5000, len(intra_artist_sims) * 10)):
-        i, j = np.random.choice(all_indices, 2, replace=False)
-        if tracks[i]['artist'] != tracks[j]['artist']:
-            sim = cosine_similarity(embeddings[i], embeddings[j])
-            inter_artist_sims.append(sim)
+    # Sample inter-artist similarities (oversample, then drop same-artist pairs)
+    n_samples = min(5000, len(intra_artist_sims) * 10)
+    rng = np.random.default_rng(42)
+    pairs = rng.integers(0, len(tracks), size=(n_samples * 2, 2))
+    pairs = pairs[artists[pairs[:, 0]] != artists[pairs[:, 1]]][:n_samples]
+    inter_artist_sims = gram_pairs(gram, pairs[:, 0], pairs[:, 1])
 
     print(f"\nIntra-artist similarities ({len(intra_artist_sims)} pairs):")
     print(f"  Mean: {np.mean(intra_artist_sims):.4f}")
@@ -118,8 +175,7 @@ def analyze_same_artist(tracks, embeddings):
     examples = []
     for artist, indices in list(multi_track_artists.items())[:20]:
         if len(indices) >= 2:
-            embs = embeddings[indices]
-            sim = cosine_similarity(embs[0], embs[1])
+            sim = gram[indices[0], indices[1]]  # indices are ascending
             examples.append((artist, tracks[indices[0]]['title'],
                            tracks[indices[1]]['title'], sim))
 
@@ -130,52 +186,43 @@ def analyze_same_artist(tracks, embeddings):
     return np.mean(intra_artist_sims), np.mean(inter_artist_sims)
 
 
-def analyze_same_genre(tracks, embeddings):
+def analyze_same_genre(tracks, gram):
     """Analyze similarity within same genre."""
     print("\n" + "="*70)
     print("SAME GENRE ANALYSIS")
     print("="*70)
 
     # Group by primary genre
-    genre_tracks = defaultdict(list)
-    for i, track in enumerate(tracks):
-        genre_tracks[track['primary_genre']].append(i)
+    genres = np.array([t['primary_genre'] for t in tracks])
+    genre_groups, genre_names = group_indices(genres)
+    genre_tracks = dict(zip(genre_names, genre_groups))
 
     print("Genre distribution:")
-    for genre in sorted(genre_tracks.keys(), key=lambda g: -len(genre_tracks[g])):
-        print(f"  {genre}: {len(genre_tracks[genre])} tracks")
+    genre_counts = Counter({genre: len(indices) for genre, indices in genre_tracks.items()})
+    for genre, count in genre_counts.most_common():
+        print(f"  {genre}: {count} tracks")
 
-    intra_genre_sims = []
-    inter_genre_sims = []
+    rng = np.random.default_rng(42)
 
     # Compute intra-genre similarities
+    sampled_genres = {}
     for genre, indices in genre_tracks.items():
         if len(indices) < 2:
             continue
-        embs = embeddings[indices]
-        # Sample pairs if too many
+        # Sample tracks if too many
         if len(indices) > 50:
-            sample_indices = np.random.choice(len(indices), 50, replace=False)
-            pairs = [(sample_indices[i], sample_indices[j])
-                    for i in range(len(sample_indices))
-                    for j in range(i+1, len(sample_indices))]
-        else:
-            pairs = [(i, j) for i in range(len(indices)) for j in range(i+1, len(indices))]
-
-        for i, j in pairs[:500]:  # Cap at 500 pairs per genre
-            sim = cosine_similarity(embs[i], embs[j])
-            intra_genre_sims.append((genre, sim))
-
-    # Sample inter-genre similarities
-    all_indices = list(range(len(tracks)))
-    np.random.seed(42)
-    for _ in range(5000):
-        i, j = np.random.choice(all_indices, 2, replace=False)
-        if tracks[i]['primary_genre'] != tracks[j]['primary_genre']:
-            sim = cosine_similarity(embeddings[i], embeddings[j])
-            inter_genre_sims.append(sim)
+            indices = indices[rng.choice(len(indices), 50, replace=False)]
+        sampled_genres[genre] = indices
+
+    # Cap at 500 pairs per genre
+    intra_sims, offsets = grouped_upper_sims(gram, sampled_genres.values(), max_pairs=500)
+    genre_means = dict(zip(sampled_genres, np.split(intra_sims, offsets[1:])))
+
+    # Sample inter-genre similarities (oversample, then drop same-genre pairs)
+    pairs = rng.integers(0, len(tracks), size=(5000 * 2, 2))
+    pairs = pairs[genres[pairs[:, 0]] != genres[pairs[:, 1]]][:5000]
+    inter_genre_sims = gram_pairs(gram, pairs[:, 0], pairs[:, 1])
 
-    intra_sims = [s for _, s in intra_genre_sims]
     print(f"\nIntra-genre similarities ({len(intra_sims)} pairs):")
     print(f"  Mean: {np.mean(intra_sims):.4f}")
     print(f"  Std:  {np.std(intra_sims):.4f}")
@@ -190,9 +237,6 @@ def analyze_same_genre(tracks, embeddings):
 
     # Per-genre stats
     print("\n--- Per Genre Mean Similarity ---")
-    genre_means = defaultdict(list)
-    for genre, sim in intra_genre_sims:
-        genre_means[genre].append(sim)
 
     for genre in sorted(genre_means.keys(), key=lambda g: -np.mean(genre_means[g])):
         sims = genre_means[genre]
@@ -201,32 +245,24 @@ def analyze_same_genre(tracks, embeddings):
     return np.mean(intra_sims), np.mean(inter_genre_sims)
 
 
-def analyze_same_album(tracks, embeddings):
+def analyze_same_album(tracks, gram):
     """Analyze similarity within same album."""
     print("\n" + "="*70)
     print("SAME ALBUM ANALYSIS")
     print("="*70)
 
-    # Group by album
-    album_tracks = defaultdict(list)
-    for i, track in enumerate(tracks):
-        key = (track['artist'], track['album'])
-        album_tracks[key].append(i)
+    # Group by (artist, album), combining the two label ids into one int key
+    _, artist_ids = np.unique([t['artist'] for t in tracks], return_inverse=True)
+    _, album_ids = np.unique([t['album'] for t in tracks], return_inverse=True)
+    album_groups, _ = group_indices(artist_ids * (album_ids.max() + 1) + album_ids)
 
     # Only analyze albums with multiple tracks
-    multi_track_albums = {a: indices for a, indices in album_tracks.items()
-                         if len(indices) >= 2}
+    multi_track_albums = [indices for indices in album_groups if len(indices) >= 2]
 
     print(f"Albums with 2+ tracks: {len(multi_track_albums)}")
 
-    intra_album_sims = []
-
-    for (artist, album), indices in multi_track_albums.items():
-        embs = embeddings[indices]
-        for i in range(len(indices)):
-            for j in range(i+1, len(indices)):
-                sim = cosine_similarity(embs[i], embs[j])
-                intra_album_sims.append(sim)
+    # All albums in one gather; offsets locate each album's first pair
+    intra_album_sims, offsets = grouped_upper_sims(gram, multi_track_albums)
 
     print(f"\nIntra-album similarities ({len(intra_album_sims)} pairs):")
     print(f"  Mean: {np.mean(intra_album_sims):.4f}")
@@ -234,56 +270,62 @@ def analyze_same_album(tracks, embeddings):
     print(f"  Min:  {np.min(intra_album_sims):.4f}")
     print(f"  Max:  {np.max(intra_album_sims):.4f}")
 
-    # Show some examples
+    # Show some examples: the first pair of each of the first 30 albums
     print("\n--- Same Album Examples ---")
-    examples = []
-    for (artist, album), indices in list(multi_track_albums.items())[:30]:
-        if len(indices) >= 2:
-            embs = embeddings[indices]
-            sim = cosine_similarity(embs[0], embs[1])
-            examples.append((artist, album, tracks[indices[0]]['title'],
-                           tracks[indices[1]]['title'], sim))
-
-    examples.sort(key=lambda x: x[4], reverse=True)
-    for artist, album, t1, t2, sim in examples[:10]:
-        print(f"  {sim:.4f} | {artist[:20]:20} - {album[:20]:20}")
+    first_pair_sims = intra_album_sims[offsets[:30]]
+    for k in np.argsort(-first_pair_sims, kind='stable')[:10]:
+        indices = multi_track_albums[k]
+        artist, album = tracks[indices[0]]['artist'], tracks[indices[0]]['album']
+        t1, t2 = tracks[indices[0]]['title'], tracks[indices[1]]['title']
+        print(f"  {first_pair_sims[k]:.4f} | {artist[:20]:20} - {album[:20]:20}")
         print(f"         | {t1[:30]} vs {t2[:30]}")
 
     return np.mean(intra_album_sims)
 
 
 def kmeans_clustering(tracks, embeddings):
-    """Perform K-means clustering and analyze results."""
+    """Perform K-means clustering and analyze results.
+
+    Expects L2-normalized embeddings, so Euclidean K-means is equivalent
+    to spherical (cosine) K-means.
+    """
     print("\n" + "="*70)
     print("K-MEANS CLUSTERING ANALYSIS")
     print("="*70)
 
+    # Silhouette is O(N^2); score a fixed random subsample
+    sil_sample_size = min(2000, len(embeddings))
+
+    # Integer genre ids so cluster composition is a single bincount
+    genre_names, genre_ids = np.unique([t['primary_genre'] for t in tracks],
+                                       return_inverse=True)
+    n_genres = len(genre_names)
+
     # Try different numbers of clusters
     for n_clusters in [5, 8, 10, 15]:
-        kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init=10)
+        kmeans = MiniBatchKMeans(n_clusters=n_clusters, random_state=42,
+                                 n_init=3, batch_size=1024)
         labels = kmeans.fit_predict(embeddings)
 
         # Compute silhouette score
-        sil_score = silhouette_score(embeddings, labels, metric='cosine')
+        sil_score = silhouette_score(embeddings, labels, metric='cosine',
+                                     sample_size=sil_sample_size, random_state=42)
 
         print(f"\nn_clusters={n_clusters}, silhouette={sil_score:.4f}")
 
-        # Analyze cluster composition by genre
-        cluster_genres = defaultdict(lambda: defaultdict(int))
-        for i, label in enumerate(labels):
-            genre = tracks[i]['primary_genre']
-            cluster_genres[label][genre] += 1
+        # Analyze cluster composition by genre: (n_clusters, n_genres) counts
+        counts = np.bincount(labels * n_genres + genre_ids,
+                             minlength=n_clusters * n_genres).reshape(n_clusters, n_genres)
 
         print("Cluster composition:")
-        for cluster in sorted(cluster_genres.keys()):
-            genres = cluster_genres[cluster]
-            total = sum(genres.values())
-            top_genres = sorted(genres.items(), key=lambda x: -x[1])[:3]
-            genre_str = ", ".join(f"{g}:{c}" for g, c in top_genres)
-            print(f"  Cluster {cluster} ({total:3} tracks): {genre_str}")
+        for cluster in np.flatnonzero(counts.sum(axis=1)):
+            genres = counts[cluster]
+            top_genres = np.argsort(-genres, kind='stable')[:3]
+            genre_str = ", ".join(f"{genre_names[g]}:{genres[g]}" for g in top_genres if genres[g])
+            print(f"  Cluster {cluster} ({genres.sum():3} tracks): {genre_str}")
 
 
-def find_nearest_neighbors(tracks, embeddings):
+def find_nearest_neighbors(tracks, gram):
     """Find and display nearest neighbors for sample tracks."""
     print("\n" + "="*70)
     print("NEAREST NEIGHBOR EXAMPLES")
@@ -293,88 +335,128 @@ def find_nearest_neighbors(tracks, embeddings):
     np.random.seed(42)
     sample_indices = np.random.choice(len(tracks), 10, replace=False)
 
-    for idx in sample_indices:
-        track = tracks[idx]
-        emb = embeddings[idx]
+    # Similarities of the sample tracks to all tracks, excluding themselves
+    # Full rows from the upper triangle: row part (j >= i) plus column part (j < i)
+    S = gram[sample_indices] + gram[:, sample_indices].T
+    S[np.arange(len(sample_indices)), sample_indices] = -np.inf
 
-        # Compute similarities to all other tracks
-        sims = []
-        for i in range(len(tracks)):
-            if i != idx:
-                sim = cosine_similarity(emb, embeddings[i])
-                sims.append((i, sim))
+    # Top 5 per row: partial sort, then order those 5 for display
+    top = np.argpartition(-S, 5, axis=1)[:, :5]
 
-        sims.sort(key=lambda x: -x[1])
+    for row, idx in enumerate(sample_indices):
+        track = tracks[idx]
+        neighbors = top[row][np.argsort(-S[row, top[row]])]
 
         print(f"\n{track['title'][:40]} by {track['artist'][:30]}")
         print(f"  Genre: {track['primary_genre']}")
         print("  5 Nearest neighbors:")
-        for i, sim in sims[:5]:
+        for i in neighbors:
+            sim = S[row, i]
             neighbor = tracks[i]
             print(f"    {sim:.4f} | {neighbor['title'][:35]:35} | {neighbor['artist'][:25]:25} | {neighbor['primary_genre']}")
 
 
-def overall_similarity_distribution(embeddings):
-    """Analyze overall similarity distribution."""
-    print("\n" + "="*70)
-    print("OVERALL SIMILARITY DISTRIBUTION")
-    print("="*70)
+def upper_pair_blocks(gram, block_size=1024):
+    """Similarities of all pairs i < j, yielded in column-block chunks.
 
-    # Sample pairwise similarities
-    n = len(embeddings)
-    np.random.seed(42)
-    n_samples = min(50000, n * (n - 1) // 2)
+    Each block of columns contributes every row above it plus the strict
+    upper triangle of its diagonal tile. The gram itself is already fully
+    materialized (main shares it across analyses); blocking only bounds the
+    size of the index and comparison temporaries.
+    """
+    n = len(gram)
+    for j0 in range(0, n, block_size):
+        j1 = min(j0 + block_size, n)
+        for sims in (gram[:j0, j0:j1].ravel(),
+                     gram[j0:j1, j0:j1][upper_triangle_pairs(j1 - j0)]):
+            if sims.size:
+                yield sims
 
-    sims = []
-    for _ in range(n_samples):
-        i, j = np.random.choice(n, 2, replace=False)
-        sim = cosine_similarity(embeddings[i], embeddings[j])
-        sims.append(sim)
 
-    sims = np.array(sims)
+def overall_similarity_distribution(gram, block_size=1024):
+    """Analyze overall similarity distribution over all track pairs.
 
-    print(f"Sampled {n_samples} random pairs:")
-    print(f"  Mean:   {np.mean(sims):.4f}")
-    print(f"  Std:    {np.std(sims):.4f}")
-    print(f"  Min:    {np.min(sims):.4f}")
-    print(f"  Max:    {np.max(sims):.4f}")
-    print(f"  Median: {np.median(sims):.4f}")
+    Walks the upper triangle of the gram matrix in blocks, keeping running
+    moments and bucket counts, and copies the pair similarities into one
+    flat array for an exact median via np.partition.
+    """
+    print("\n" + "="*70)
+    print("OVERALL SIMILARITY DISTRIBUTION")
+    print("="*70)
 
-    # Distribution buckets
+    # Half-open [low, high) buckets, compared in the gram's precision as
+    # `low <= sims < high` would be; values outside [0, 1) are not counted
+    bucket_edges = np.array([0.0, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 1.0], dtype=gram.dtype)
+    bucket_counts = np.zeros(len(bucket_edges) + 1, dtype=np.int64)
+    # Every pair similarity, filled block by block, for the median
+    n = len(gram)
+    values = np.empty(n * (n - 1) // 2, dtype=gram.dtype)
+
+    count, total, total_sq = 0, 0.0, 0.0
+    min_sim, max_sim = np.inf, -np.inf
+
+    for sims in upper_pair_blocks(gram, block_size):
+        values[count:count + sims.size] = sims
+        count += sims.size
+        total += sims.sum(dtype=np.float64)
+        total_sq += np.square(sims, dtype=np.float64).sum()
+        min_sim = min(min_sim, sims.min())
+        max_sim = max(max_sim, sims.max())
+        bucket_counts += np.bincount(np.searchsorted(bucket_edges, sims, side='right'),
+                                     minlength=len(bucket_counts))
+
+    mean = total / count
+    std = np.sqrt(max(total_sq / count - mean * mean, 0.0))
+
+    # Middle rank(s), as np.median: the mean of the two middle values for even counts
+    ranks = [(count - 1) // 2, count // 2]
+    values.partition(ranks)
+    median = (float(values[ranks[0]]) + float(values[ranks[1]])) / 2
+
+    print(f"All {count} track pairs:")
+    print(f"  Mean:   {mean:.4f}")
+    print(f"  Std:    {std:.4f}")
+    print(f"  Min:    {min_sim:.4f}")
+    print(f"  Max:    {max_sim:.4f}")
+    print(f"  Median: {median:.4f}")
+
+    # Distribution buckets; searchsorted index i + 1 is bucket [edges[i], edges[i+1])
     print("\nSimilarity distribution:")
-    buckets = [(0.0, 0.5), (0.5, 0.6), (0.6, 0.7), (0.7, 0.8), (0.8, 0.9), (0.9, 0.95), (0.95, 1.0)]
-    for low, high in buckets:
-        count = np.sum((sims >= low) & (sims < high))
-        pct = 100 * count / len(sims)
-        print(f"  [{low:.2f}, {high:.2f}): {count:5} ({pct:5.1f}%)")
+    for low, high, bucket_count in zip(bucket_edges[:-1], bucket_edges[1:], bucket_counts[1:-1]):
+        pct = 100 * bucket_count / count
+        print(f"  [{low:.2f}, {high:.2f}): {bucket_count:5} ({pct:5.1f}%)")
 
 
 def main():
     print("Fetching embeddings from database...")
     tracks, embeddings = get_data()
-    print(f"Loaded {len(tracks)} tracks with {embeddings.shape[1]}-dim embeddings")
+    print(f"Loaded {len(tracks)} tracks with {embeddings.shape[1]}-dim {embeddings.dtype} embeddings")
+
+    # Normalize embeddings for cosine similarity: one reciprocal per row,
+    # then scale in place rather than dividing into a second N x D copy
+    inv_norms = 1.0 / (np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-10)
+    embeddings *= inv_norms
 
-    # Normalize embeddings for cosine similarity
-    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
-    embeddings_normed = embeddings / (norms + 1e-10)
+    # Cosine similarity matrix, computed once and shared by the analyses
+    gram = cosine_gram(embeddings, use_gpu='--gpu' in sys.argv[1:])
 
     # Overall statistics
-    overall_similarity_distribution(embeddings)
+    overall_similarity_distribution(gram)
 
     # Same artist analysis
-    intra_artist, inter_artist = analyze_same_artist(tracks, embeddings)
+    intra_artist, inter_artist = analyze_same_artist(tracks, gram)
 
     # Same genre analysis
-    intra_genre, inter_genre = analyze_same_genre(tracks, embeddings)
+    intra_genre, inter_genre = analyze_same_genre(tracks, gram)
 
     # Same album analysis
-    intra_album = analyze_same_album(tracks, embeddings)
+    intra_album = analyze_same_album(tracks, gram)
 
     # K-means clustering
     kmeans_clustering(tracks, embeddings)
 
     # Nearest neighbors
-    find_nearest_neighbors(tracks, embeddings)
+    find_nearest_neighbors(tracks, gram)
 
     # Summary
     print("\n" + "="*70)
@@ -3,7 +3,10 @@
 Analyze similarity between seed tracks and playlist tracks.
 """
 
+import csv
+import io
 import json
+import re
 import numpy as np
 import psycopg2
 from collections import defaultdict
@@ -221,10 +224,6 @@ Joji - COME THRU
 JAY-Z • Frank Ocean - Caught Their Eyes""".strip().split('\n')
 
 
-def cosine_similarity(a, b):
-    return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b) + 1e-10)
-
-
 def parse_track_name(name):
     """Parse 'Artist - Title' format, handling bullet points for features."""
     # Replace bullet with comma for consistency
@@ -247,22 +246,32 @@ def get_embeddings():
     )
     cur = conn.cursor()
 
-    cur.execute("""
-        SELECT te.track_id, li.title, li.artist, li.album, li.genres,
-               te.embedding::text
-        FROM track_embeddings te
-        JOIN library_index li ON te.track_id = li.id
-    """)
+    # Stream rows as one CSV blob instead of per-cell adapters
+    buf = io.StringIO()
+    cur.copy_expert("""
+        COPY (
+            SELECT te.track_id, li.title, li.artist, li.album, li.genres,
+                   te.embedding::text
+            FROM track_embeddings te
+            JOIN library_index li ON te.track_id = li.id
+        ) TO STDOUT WITH (FORMAT CSV)
+    """, buf)
 
-    rows = cur.fetchall()
     cur.close()
     conn.close()
 
-    tracks = {}
-    for row in rows:
-        track_id, title, artist, album, genres, emb_str = row
-        emb = np.array([float(x) for x in emb_str.strip('[]').split(',')])
+    buf.seek(0)
+    rows = list(csv.reader(buf))
+
+    # Parse every vector in one pass, then normalize once so similarity
+    # is a plain dot product
+    embeddings = np.fromstring(
+        ','.join(row[5][1:-1] for row in rows), sep=',', dtype=np.float32
+    ).reshape(len(rows), -1)
+    embeddings *= 1.0 / (np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-10)
 
+    tracks = {}
+    for (track_id, title, artist, album, genres, _), emb in zip(rows, embeddings):
         # Create lookup key
         key = f"{artist} - {title}".lower()
         tracks[key] = {
@@ -270,14 +279,29 @@ def get_embeddings():
             'title': title,
             'artist': artist,
             'album': album,
-            'genres': genres,
+            'genres': json.loads(genres) if genres else [],
             'embedding': emb
         }
 
     return tracks
 
 
-def find_track(tracks_db, search_name):
+def tokenize(name):
+    """Split a lowercased track name into word tokens."""
+    return re.findall(r'\w+', name)
+
+
+def build_token_index(tracks_db):
+    """Build an inverted index mapping word tokens to track key positions."""
+    keys = list(tracks_db)
+    token_index = defaultdict(list)
+    for pos, key in enumerate(keys):
+        for token in set(tokenize(key)):
+            token_index[token].append(pos)
+    return keys, token_index
+
+
+def find_track(tracks_db, search_index, search_name):
     """Find a track in the database by fuzzy matching."""
     search_name = search_name.replace(' • ', ', ').lower()
 
@@ -285,16 +309,24 @@ def find_track(tracks_db, search_name):
     if search_name in tracks_db:
         return tracks_db[search_name]
 
-    # Try partial matches
-    for key, track in tracks_db.items():
+    # Only keys sharing a whole word token with the query are candidates.
+    # A key that matched the old full scan only through a word cut mid-way
+    # (e.g. "love" inside "lovely") is no longer found; among the candidates,
+    # load order still decides which partial match wins
+    keys, token_index = search_index
+    candidates = sorted({pos for token in tokenize(search_name)
+                         for pos in token_index.get(token, ())})
+    search_artist, search_title = parse_track_name(search_name)
+
+    for pos in candidates:
+        key = keys[pos]
         # Check if artist and title are contained
         if search_name in key or key in search_name:
-            return track
+            return tracks_db[key]
 
         # Parse and match components
-        search_artist, search_title = parse_track_name(search_name)
-        if search_artist.lower() in key and search_title.lower() in key:
-            return track
+        if search_artist in key and search_title in key:
+            return tracks_db[key]
 
     return None
 
@@ -303,6 +335,7 @@ def main():
     print("Fetching embeddings from database...")
     tracks_db = get_embeddings()
     print(f"Loaded {len(tracks_db)} tracks with embeddings\n")
+    search_index = build_token_index(tracks_db)
 
     # Find seed embeddings
     print("=" * 70)
@@ -312,7 +345,7 @@ def main():
     seed_embeddings = []
     seed_names = []
     for seed in SEED_TRACKS:
-        track = find_track(tracks_db, seed)
+        track = find_track(tracks_db, search_index, seed)
         if track:
             seed_embeddings.append(track['embedding'])
             seed_names.append(seed)
@@ -324,36 +357,44 @@ def main():
         print("No seed embeddings found!")
         return
 
-    seed_embeddings = np.array(seed_embeddings)
+    seed_embeddings = np.asarray(seed_embeddings, dtype=np.float32)
 
     # Analyze playlist tracks
     print("\n" + "=" * 70)
     print("PLAYLIST TRACK ANALYSIS")
     print("=" * 70)
 
-    results = []
+    found = []
     not_found = []
 
     for playlist_track in PLAYLIST_TRACKS:
-        track = find_track(tracks_db, playlist_track)
+        track = find_track(tracks_db, search_index, playlist_track)
         if track:
-            # Compute similarity to each seed
-            sims = [cosine_similarity(track['embedding'], seed_emb) for seed_emb in seed_embeddings]
-            max_sim = max(sims)
-            avg_sim = np.mean(sims)
-            closest_seed_idx = np.argmax(sims)
-
-            results.append({
-                'name': playlist_track,
-                'max_sim': max_sim,
-                'avg_sim': avg_sim,
-                'closest_seed': seed_names[closest_seed_idx],
-                'all_sims': sims,
-                'genres': track.get('genres', [])
-            })
+            found.append((playlist_track, track))
         else:
             not_found.append(playlist_track)
 
+    # Similarity of every playlist track to every seed in one matmul
+    # (embeddings are already L2-normalized)
+    P = np.stack([t['embedding'] for _, t in found])
+    S = P @ seed_embeddings.T
+
+    max_sims = S.max(axis=1)
+    avg_sims = S.mean(axis=1)
+    closest_seed_idxs = S.argmax(axis=1)
+
+    results = []
+    for (name, track), sims, max_sim, avg_sim, closest_seed_idx in zip(
+            found, S, max_sims, avg_sims, closest_seed_idxs):
+        results.append({
+            'name': name,
+            'max_sim': max_sim,
+            'avg_sim': avg_sim,
+            'closest_seed': seed_names[closest_seed_idx],
+            'all_sims': sims,
+            'genres': track.get('genres', [])
+        })
+
     # Sort by max similarity (lowest first to find outliers)
     results.sort(key=lambda x: x['max_sim'])
 
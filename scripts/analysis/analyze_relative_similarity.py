@@ -5,13 +5,19 @@ Focus on: Can the model distinguish similar vs different music?
 """
 
 import json
+import os
 import numpy as np
 import psycopg2
-from collections import defaultdict
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from threadpoolctl import threadpool_limits
+
+from _cache import db_state_key, load_cache, save_cache
 
 
 def get_data():
-    """Fetch embeddings and metadata from database."""
+    """Fetch embeddings and metadata from database, or the on-disk cache."""
     conn = psycopg2.connect(
         host="localhost",
         port=5432,
@@ -19,7 +25,17 @@ def get_data():
         user="postgres",
         password="postgres"
     )
-    cur = conn.cursor()
+
+    # Skip the full fetch and parse when the database hasn't changed
+    key = db_state_key(conn)
+    cached = load_cache("relative", key)
+    if cached is not None:
+        conn.close()
+        return cached
+
+    # Server-side cursor so rows are parsed in chunks instead of all held at once
+    cur = conn.cursor(name='emb_stream')
+    cur.itersize = 4096
 
     cur.execute("""
         SELECT te.track_id, li.title, li.artist, li.album, li.genres,
@@ -28,136 +44,136 @@ def get_data():
         JOIN library_index li ON te.track_id = li.id
     """)
 
-    rows = cur.fetchall()
+    tracks = []
+    chunks = []
+    while True:
+        rows = cur.fetchmany(cur.itersize)
+        if not rows:
+            break
+
+        # Parse each chunk of postgres vectors "[1,2,3,...]" in a single C-level pass
+        chunks.append(np.fromstring(
+            ','.join(row[5][1:-1] for row in rows), sep=',', dtype=np.float32
+        ).reshape(len(rows), -1))
+
+        for track_id, title, artist, album, genres, _ in rows:
+            genres_list = genres if isinstance(genres, list) else json.loads(genres) if genres else []
+
+            tracks.append({
+                'id': track_id,
+                'title': title,
+                'artist': artist,
+                'album': album,
+                'genres': genres_list,
+                'primary_genre': genres_list[0] if genres_list else 'Unknown'
+            })
+
     cur.close()
     conn.close()
 
-    tracks = []
-    embeddings = []
-
-    for row in rows:
-        track_id, title, artist, album, genres, emb_str = row
-        emb = np.array([float(x) for x in emb_str.strip('[]').split(',')])
+    embeddings = np.concatenate(chunks)
 
-        genres_list = genres if isinstance(genres, list) else json.loads(genres) if genres else []
+    # L2-normalize once so cosine similarity is a plain dot product / matmul
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-10
 
-        tracks.append({
-            'id': track_id,
-            'title': title,
-            'artist': artist,
-            'album': album,
-            'genres': genres_list,
-            'primary_genre': genres_list[0] if genres_list else 'Unknown'
-        })
-        embeddings.append(emb)
+    save_cache("relative", key, embeddings, tracks)
 
-    return tracks, np.array(embeddings)
+    return tracks, embeddings
 
 
-def cosine_similarity(a, b):
-    return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b) + 1e-10)
+# Ordered (category, keywords) rules; the first rule with a keyword
+# contained in the lowercased genre wins
+_CATEGORY_RULES = [
+    ('Heavy', ('metal', 'punk', 'hardcore')),
+    ('Electronic', ('electro', 'electronic', 'dance', 'edm', 'house', 'techno')),
+    ('Hip-Hop', ('rap', 'hip hop', 'hip-hop', 'screwed')),
+    ('R&B/Soul', ('r&b', 'soul', 'funk')),
+    ('Rock', ('rock', 'indie')),
+    ('Jazz', ('jazz',)),
+    ('Pop', ('pop',)),
+    ('Country', ('country',)),
+    ('Alternative', ('alternative',)),
+]
 
 
+@lru_cache(maxsize=None)
 def categorize_genre(genre):
-    """Map specific genres to broader categories."""
+    """Map specific genres to broader categories (memoized per genre string)."""
     genre_lower = genre.lower()
-
-    # Heavy/aggressive
-    if any(x in genre_lower for x in ['metal', 'punk', 'hardcore']):
-        return 'Heavy'
-
-    # Electronic
-    if any(x in genre_lower for x in ['electro', 'electronic', 'dance', 'edm', 'house', 'techno']):
-        return 'Electronic'
-
-    # Hip-hop/Rap
-    if any(x in genre_lower for x in ['rap', 'hip hop', 'hip-hop', 'screwed']):
-        return 'Hip-Hop'
-
-    # R&B/Soul
-    if any(x in genre_lower for x in ['r&b', 'soul', 'funk']):
-        return 'R&B/Soul'
-
-    # Rock
-    if any(x in genre_lower for x in ['rock', 'indie']):
-        return 'Rock'
-
-    # Jazz
-    if 'jazz' in genre_lower:
-        return 'Jazz'
-
-    # Pop
-    if 'pop' in genre_lower:
-        return 'Pop'
-
-    # Country
-    if 'country' in genre_lower:
-        return 'Country'
-
-    # Alternative
-    if 'alternative' in genre_lower:
-        return 'Alternative'
-
+    for category, keywords in _CATEGORY_RULES:
+        if any(x in genre_lower for x in keywords):
+            return category
     return 'Other'
 
 
-def analyze_cross_genre(tracks, embeddings):
+def category_fit_scores(category_embeddings):
+    """Mean similarity of each track to the rest of its category.
+
+    The per-category blocks E_c @ E_c.T are independent, so a few of them
+    run at once on a thread pool (BLAS releases the GIL), with the cores split
+    between the workers' BLAS calls rather than oversubscribed. Each block is
+    reduced to row means in its worker, so at most one block per worker is
+    alive. The mean of a category's fits is its mean within-category
+    similarity.
+    """
+    def fits(emb):
+        block = emb @ emb.T
+        return (block.sum(axis=1) - block.diagonal()) / max(len(emb) - 1, 1)
+
+    cores = os.cpu_count() or 1
+    workers = min(4, cores)
+    with threadpool_limits(limits=max(1, cores // workers)), \
+            ThreadPoolExecutor(max_workers=workers) as pool:
+        return dict(zip(category_embeddings, pool.map(fits, category_embeddings.values())))
+
+
+def sorted_extremes(values, k, largest=False):
+    """Positions of the k smallest (or largest) values, in ascending order.
+
+    Finds the k-th value with a partition so only the selected positions
+    get sorted; ties are resolved by position, as a stable full sort would.
+    """
+    k = min(k, len(values))
+    if k == 0:
+        return np.arange(0)
+    kth = len(values) - k if largest else k - 1
+    threshold = np.partition(values, kth)[kth]
+    ties = np.flatnonzero(values == threshold)
+    if largest:
+        strict = np.flatnonzero(values > threshold)
+        positions = np.concatenate((ties[len(ties) - (k - len(strict)):], strict))
+    else:
+        strict = np.flatnonzero(values < threshold)
+        positions = np.concatenate((strict, ties[:k - len(strict)]))
+    return positions[np.lexsort((positions, values[positions]))]
+
+
+def analyze_cross_genre(category_embeddings, category_fits):
     """Analyze similarity between very different genres."""
     print("\n" + "="*70)
     print("CROSS-GENRE SIMILARITY ANALYSIS")
     print("="*70)
 
-    # Categorize tracks
-    for track in tracks:
-        track['category'] = categorize_genre(track['primary_genre'])
-
-    # Count categories
-    category_counts = defaultdict(int)
-    for track in tracks:
-        category_counts[track['category']] += 1
-
     print("\nCategory distribution:")
-    for cat in sorted(category_counts.keys(), key=lambda x: -category_counts[x]):
-        print(f"  {cat}: {category_counts[cat]} tracks")
-
-    # Group by category
-    category_indices = defaultdict(list)
-    for i, track in enumerate(tracks):
-        category_indices[track['category']].append(i)
+    category_counts = Counter({cat: len(emb) for cat, emb in category_embeddings.items()})
+    for cat, count in category_counts.most_common():
+        print(f"  {cat}: {count} tracks")
 
     # Compute within-category and between-category similarities
-    categories = [c for c in category_indices.keys() if len(category_indices[c]) >= 5]
+    categories = [c for c in category_embeddings.keys() if len(category_embeddings[c]) >= 5]
 
     print(f"\nAnalyzing {len(categories)} categories with 5+ tracks")
 
     # Within-category similarities
-    within_sims = {}
-    for cat in categories:
-        indices = category_indices[cat]
-        sims = []
-        for i in range(len(indices)):
-            for j in range(i+1, len(indices)):
-                sim = cosine_similarity(embeddings[indices[i]], embeddings[indices[j]])
-                sims.append(sim)
-        if sims:
-            within_sims[cat] = np.mean(sims)
-
-    # Between-category similarities
+    within_sims = {cat: np.mean(category_fits[cat]) for cat in categories}
+
+    # Between-category similarities: the mean dot product over all cross
+    # pairs equals the dot product of the two category centroids
+    centroids = {cat: category_embeddings[cat].mean(axis=0) for cat in categories}
     between_sims = {}
     for i, cat1 in enumerate(categories):
         for cat2 in categories[i+1:]:
-            indices1 = category_indices[cat1]
-            indices2 = category_indices[cat2]
-            sims = []
-            # Sample pairs
-            np.random.seed(42)
-            n_samples = min(200, len(indices1) * len(indices2))
-            for _ in range(n_samples):
-                idx1 = np.random.choice(indices1)
-                idx2 = np.random.choice(indices2)
-                sim = cosine_similarity(embeddings[idx1], embeddings[idx2])
-                sims.append(sim)
-            between_sims[(cat1, cat2)] = np.mean(sims)
+            between_sims[(cat1, cat2)] = float(centroids[cat1] @ centroids[cat2])
 
     # Print within-category
     print("\n--- Within-Category Mean Similarity ---")
@@ -200,32 +216,31 @@ def analyze_extreme_comparisons(tracks, embeddings):
     n = len(tracks)
     print(f"\nComputing pairwise similarities for {n} tracks...")
 
-    all_pairs = []
-    for i in range(n):
-        for j in range(i+1, n):
-            sim = cosine_similarity(embeddings[i], embeddings[j])
-            all_pairs.append((i, j, sim))
-
-    all_pairs.sort(key=lambda x: x[2])
+    # One matmul for all pairs; only the extremes and the median are needed,
+    # so they are selected with partial sorts rather than ordering every pair
+    iu, ju = np.triu_indices(n, k=1)
+    sims = (embeddings @ embeddings.T)[iu, ju]
 
     # Most different pairs
     print("\n--- 15 MOST DIFFERENT Track Pairs ---")
-    for i, j, sim in all_pairs[:15]:
+    lowest = sorted_extremes(sims, 15)
+    for i, j, sim in zip(iu[lowest], ju[lowest], sims[lowest]):
         t1, t2 = tracks[i], tracks[j]
         print(f"  {sim:.4f} | {t1['title'][:25]:25} ({t1['primary_genre'][:12]:12}) vs {t2['title'][:25]:25} ({t2['primary_genre'][:12]})")
 
     # Most similar pairs (excluding same artist)
     print("\n--- 15 MOST SIMILAR Track Pairs (different artists) ---")
-    same_artist_excluded = [(i, j, sim) for i, j, sim in all_pairs
-                            if tracks[i]['artist'] != tracks[j]['artist']]
-    for i, j, sim in same_artist_excluded[-15:]:
+    _, artist_ids = np.unique([t['artist'] for t in tracks], return_inverse=True)
+    different = np.flatnonzero(artist_ids[iu] != artist_ids[ju])
+    different = different[sorted_extremes(sims[different], 15, largest=True)]
+    for i, j, sim in zip(iu[different], ju[different], sims[different]):
         t1, t2 = tracks[i], tracks[j]
         print(f"  {sim:.4f} | {t1['title'][:25]:25} ({t1['artist'][:15]:15}) vs {t2['title'][:25]:25} ({t2['artist'][:15]})")
 
     # Similarity range
-    min_sim = all_pairs[0][2]
-    max_sim = all_pairs[-1][2]
-    median_sim = all_pairs[len(all_pairs)//2][2]
+    min_sim = sims.min()
+    max_sim = sims.max()
+    median_sim = np.partition(sims, len(sims)//2)[len(sims)//2]
 
     print(f"\n--- Similarity Range ---")
     print(f"  Min: {min_sim:.4f}")
@@ -233,10 +248,10 @@ def analyze_extreme_comparisons(tracks, embeddings):
     print(f"  Max: {max_sim:.4f}")
     print(f"  Range: {max_sim - min_sim:.4f}")
 
-    return all_pairs
+    return iu, ju, sims
 
 
-def analyze_genre_separation(tracks, embeddings):
+def analyze_genre_separation(category_embeddings, category_fits):
     """Check if specific genres are separable."""
     print("\n" + "="*70)
     print("GENRE SEPARATION ANALYSIS")
@@ -254,120 +269,77 @@ def analyze_genre_separation(tracks, embeddings):
         ('R&B', 'Metal'),
     ]
 
-    # Categorize
-    for track in tracks:
-        track['category'] = categorize_genre(track['primary_genre'])
-
-    category_indices = defaultdict(list)
-    for i, track in enumerate(tracks):
-        category_indices[track['category']].append(i)
-
     print("\n--- Same vs Different Genre Comparison ---")
     print(f"{'Genre Pair':30} | {'Same-Genre':12} | {'Cross-Genre':12} | {'Separation':12}")
     print("-" * 70)
 
     for cat1, cat2 in test_pairs:
-        if cat1 not in category_indices or cat2 not in category_indices:
+        if cat1 not in category_embeddings or cat2 not in category_embeddings:
             continue
-        if len(category_indices[cat1]) < 3 or len(category_indices[cat2]) < 3:
+        if len(category_embeddings[cat1]) < 3 or len(category_embeddings[cat2]) < 3:
             continue
 
-        # Within cat1
-        indices1 = category_indices[cat1]
-        within_sims = []
-        for i in range(len(indices1)):
-            for j in range(i+1, len(indices1)):
-                sim = cosine_similarity(embeddings[indices1[i]], embeddings[indices1[j]])
-                within_sims.append(sim)
-
-        # Between cat1 and cat2
-        indices2 = category_indices[cat2]
-        between_sims = []
-        np.random.seed(42)
-        for _ in range(min(200, len(indices1) * len(indices2))):
-            idx1 = np.random.choice(indices1)
-            idx2 = np.random.choice(indices2)
-            sim = cosine_similarity(embeddings[idx1], embeddings[idx2])
-            between_sims.append(sim)
-
-        within_mean = np.mean(within_sims) if within_sims else 0
-        between_mean = np.mean(between_sims) if between_sims else 0
+        # Between cat1 and cat2, exactly, as the dot product of their centroids
+        between_mean = float(category_embeddings[cat1].mean(axis=0) @ category_embeddings[cat2].mean(axis=0))
+
+        within_mean = np.mean(category_fits[cat1])
         separation = within_mean - between_mean
 
         print(f"{cat1:12} vs {cat2:12} | {within_mean:.4f}       | {between_mean:.4f}       | {separation:+.4f}")
 
 
-def find_outliers_per_genre(tracks, embeddings):
+def find_outliers_per_genre(tracks, category_indices, category_fits):
     """Find tracks that don't fit their genre."""
     print("\n" + "="*70)
     print("GENRE OUTLIERS (tracks that don't match their genre embedding-wise)")
     print("="*70)
 
-    # Categorize
-    for track in tracks:
-        track['category'] = categorize_genre(track['primary_genre'])
-
-    category_indices = defaultdict(list)
-    for i, track in enumerate(tracks):
-        category_indices[track['category']].append(i)
-
     for cat in ['Hip-Hop', 'Rock', 'Electronic', 'Jazz', 'Alternative']:
         if cat not in category_indices or len(category_indices[cat]) < 5:
             continue
 
         indices = category_indices[cat]
 
-        # Compute mean similarity to own genre for each track
-        track_genre_fit = []
-        for idx in indices:
-            sims = []
-            for other_idx in indices:
-                if idx != other_idx:
-                    sim = cosine_similarity(embeddings[idx], embeddings[other_idx])
-                    sims.append(sim)
-            mean_sim = np.mean(sims) if sims else 0
-            track_genre_fit.append((idx, mean_sim))
-
-        track_genre_fit.sort(key=lambda x: x[1])
+        # Mean similarity of each track to the rest of its genre
+        fits = category_fits[cat]
 
         print(f"\n{cat} outliers (lowest fit to genre):")
-        for idx, fit in track_genre_fit[:3]:
-            t = tracks[idx]
+        for k in np.argsort(fits, kind='stable')[:3]:
+            fit = fits[k]
+            t = tracks[indices[k]]
             print(f"  {fit:.4f} | {t['title'][:30]:30} by {t['artist'][:20]}")
 
 
-def nearest_neighbor_accuracy(tracks, embeddings):
+def nearest_neighbor_accuracy(tracks, embeddings, block_size=1024):
     """Check if nearest neighbors tend to be same genre."""
     print("\n" + "="*70)
     print("NEAREST NEIGHBOR GENRE ACCURACY")
     print("="*70)
 
-    # Categorize
-    for track in tracks:
-        track['category'] = categorize_genre(track['primary_genre'])
-
     # For each track, find k nearest neighbors and check genre match
     k_values = [1, 3, 5, 10]
 
-    for k in k_values:
-        correct = 0
-        total = 0
-
-        for i in range(len(tracks)):
-            # Compute similarity to all other tracks
-            sims = []
-            for j in range(len(tracks)):
-                if i != j:
-                    sim = cosine_similarity(embeddings[i], embeddings[j])
-                    sims.append((j, sim))
-
-            sims.sort(key=lambda x: -x[1])
-            neighbors = sims[:k]
+    # Top max(k) neighbors per track, partitioned then sorted by similarity.
+    # Rows are processed in blocks so only a block_size x N similarity
+    # buffer is live at a time, with self-matches excluded
+    n = len(tracks)
+    k_max = min(max(k_values), n - 1)
+    neighbors = np.empty((n, k_max), dtype=np.intp)
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        sims = embeddings[start:stop] @ embeddings.T
+        sims[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+        top = np.argpartition(-sims, k_max - 1, axis=1)[:, :k_max]
+        order = np.argsort(-np.take_along_axis(sims, top, axis=1), axis=1, kind='stable')
+        neighbors[start:stop] = np.take_along_axis(top, order, axis=1)
+
+    categories = np.array([t['category'] for t in tracks])
+    same_cat = categories[neighbors] == categories[:, None]
 
-            # Check how many neighbors share the same category
-            same_cat = sum(1 for j, _ in neighbors if tracks[j]['category'] == tracks[i]['category'])
-            correct += same_cat
-            total += k
+    for k in k_values:
+        # Check how many neighbors share the same category
+        correct = same_cat[:, :k].sum()
+        total = k * len(tracks)
 
         accuracy = correct / total if total > 0 else 0
         print(f"  k={k:2}: {accuracy:.2%} of nearest neighbors share genre category")
@@ -378,17 +350,26 @@ def main():
     tracks, embeddings = get_data()
     print(f"Loaded {len(tracks)} tracks with {embeddings.shape[1]}-dim embeddings")
 
+    # Categorize and group tracks once, with each category's embeddings
+    # gathered up front for the per-category analyses
+    category_indices = defaultdict(list)
+    for i, track in enumerate(tracks):
+        track['category'] = categorize_genre(track['primary_genre'])
+        category_indices[track['category']].append(i)
+    category_embeddings = {cat: embeddings[indices] for cat, indices in category_indices.items()}
+    category_fits = category_fit_scores(category_embeddings)
+
     # Cross-genre analysis
-    analyze_cross_genre(tracks, embeddings)
+    analyze_cross_genre(category_embeddings, category_fits)
 
     # Extreme comparisons
     analyze_extreme_comparisons(tracks, embeddings)
 
     # Genre separation
-    analyze_genre_separation(tracks, embeddings)
+    analyze_genre_separation(category_embeddings, category_fits)
 
     # Genre outliers
-    find_outliers_per_genre(tracks, embeddings)
+    find_outliers_per_genre(tracks, category_indices, category_fits)
 
     # Nearest neighbor accuracy
     nearest_neighbor_accuracy(tracks, embeddings)
@@ -4,16 +4,13 @@ Analyze similarity between seed tracks and station tracks.
 Fetches directly from the database for the 'sb' station.
 """
 
-import json
 import numpy as np
 import psycopg2
-from collections import defaultdict
-
-STATION_ID = "46db7e7d-4d03-4b6c-936d-25b78c413852"  # sb station
+from collections import Counter
 
+from _cache import db_state_key, load_cache, save_cache
 
-def cosine_similarity(a, b):
-    return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b) + 1e-10)
+STATION_ID = "46db7e7d-4d03-4b6c-936d-25b78c413852"  # sb station
 
 
 def get_connection():
@@ -27,34 +24,62 @@ def get_connection():
 
 
 def get_all_embeddings():
-    """Fetch all embeddings from database."""
+    """Fetch all embeddings from database, or the on-disk cache."""
     conn = get_connection()
-    cur = conn.cursor()
+
+    # Skip the full fetch and parse when the database hasn't changed
+    key = db_state_key(conn)
+    cached = load_cache("station", key)
+    if cached is not None:
+        conn.close()
+        meta, embeddings = cached
+        return {
+            track_id: {'id': track_id, 'title': title, 'artist': artist,
+                       'artist_lower': artist.lower(), 'embedding': emb}
+            for (track_id, title, artist), emb in zip(meta, embeddings)
+        }
+
+    # Server-side cursor so rows are parsed in chunks instead of all held at once
+    cur = conn.cursor(name='emb_stream')
+    cur.itersize = 4096
 
     cur.execute("""
-        SELECT te.track_id, li.title, li.artist, li.album, li.genres,
-               te.embedding::text
+        SELECT te.track_id, li.title, li.artist, te.embedding::text
         FROM track_embeddings te
         JOIN library_index li ON te.track_id = li.id
     """)
 
-    rows = cur.fetchall()
+    tracks = {}
+    meta = []
+    chunks = []
+    while True:
+        rows = cur.fetchmany(cur.itersize)
+        if not rows:
+            break
+
+        # Parse each chunk of postgres vectors "[1,2,3,...]" in a single C-level pass
+        embeddings = np.fromstring(
+            ','.join(row[3][1:-1] for row in rows), sep=',', dtype=np.float32
+        ).reshape(len(rows), -1)
+
+        # L2-normalize once so cosine similarity is a plain dot product
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-10
+        chunks.append(embeddings)
+
+        for (track_id, title, artist, _), emb in zip(rows, embeddings):
+            tracks[track_id] = {
+                'id': track_id,
+                'title': title,
+                'artist': artist,
+                'artist_lower': artist.lower(),
+                'embedding': emb
+            }
+            meta.append((track_id, title, artist))
+
     cur.close()
     conn.close()
 
-    tracks = {}
-    for row in rows:
-        track_id, title, artist, album, genres, emb_str = row
-        emb = np.array([float(x) for x in emb_str.strip('[]').split(',')])
-
-        tracks[track_id] = {
-            'id': track_id,
-            'title': title,
-            'artist': artist,
-            'album': album,
-            'genres': genres,
-            'embedding': emb
-        }
+    save_cache("station", key, np.concatenate(chunks), meta)
 
     return tracks
 
@@ -77,16 +102,16 @@ def get_station_tracks(station_id):
     return []
 
 
+def is_suicideboys_track(track):
+    """Whether a track is by $uicideboy$, matched on the lowercased artist."""
+    artist = track['artist_lower']
+    return '$uicideboy$' in artist or 'suicideboy' in artist
+
+
 def identify_seeds(track_ids, all_tracks):
     """Identify which tracks are likely seeds ($uicideboy$ tracks)."""
-    seeds = []
-    for tid in track_ids:
-        if tid in all_tracks:
-            track = all_tracks[tid]
-            artist = track['artist'].lower()
-            if '$uicideboy$' in artist or 'suicideboy' in artist:
-                seeds.append(track)
-    return seeds
+    return [all_tracks[tid] for tid in track_ids
+            if tid in all_tracks and is_suicideboys_track(all_tracks[tid])]
 
 
 def main():
@@ -111,82 +136,64 @@ def main():
         return
 
     seed_embeddings = np.array([s['embedding'] for s in seeds])
+    seed_ids = {s['id'] for s in seeds}
 
     # Analyze non-seed tracks
     print("\n" + "=" * 70)
     print("PLAYLIST TRACK ANALYSIS")
     print("=" * 70)
 
-    results = []
-    missing = 0
-
-    for tid in station_track_ids:
-        if tid not in all_tracks:
-            missing += 1
-            continue
-
-        track = all_tracks[tid]
-
-        # Skip if it's a seed
-        if any(s['id'] == tid for s in seeds):
-            continue
-
-        # Compute similarity to each seed
-        sims = [cosine_similarity(track['embedding'], seed_emb) for seed_emb in seed_embeddings]
-        max_sim = max(sims)
-        avg_sim = np.mean(sims)
-        closest_seed_idx = np.argmax(sims)
-
-        results.append({
-            'id': tid,
-            'name': f"{track['artist']} - {track['title']}",
-            'artist': track['artist'],
-            'title': track['title'],
-            'max_sim': max_sim,
-            'avg_sim': avg_sim,
-            'closest_seed': f"{seeds[closest_seed_idx]['artist']} - {seeds[closest_seed_idx]['title']}",
-            'all_sims': sims,
-            'genres': track.get('genres', [])
-        })
-
-    # Sort by max similarity (lowest first)
-    results.sort(key=lambda x: x['max_sim'])
-
-    print(f"\nAnalyzed {len(results)} non-seed tracks")
+    missing = sum(1 for tid in station_track_ids if tid not in all_tracks)
+
+    # Non-seed station tracks with embeddings
+    valid_ids = [tid for tid in station_track_ids
+                 if tid in all_tracks and tid not in seed_ids]
+
+    # Similarity of every seed to every station track in one matmul
+    sim_matrix = seed_embeddings @ np.array([all_tracks[tid]['embedding'] for tid in valid_ids]).T
+
+    # Per-track results as parallel arrays, sorted by max similarity (lowest first)
+    max_sims = sim_matrix.max(axis=0)
+    order = np.argsort(max_sims, kind='stable')
+    max_sims = max_sims[order]
+    avg_sims = sim_matrix.mean(axis=0)[order]
+    artists = np.array([all_tracks[valid_ids[i]]['artist'] for i in order])
+    names = [f"{all_tracks[valid_ids[i]]['artist']} - {all_tracks[valid_ids[i]]['title']}" for i in order]
+
+    print(f"\nAnalyzed {len(names)} non-seed tracks")
     print(f"Missing embeddings: {missing} tracks\n")
 
     # Worst fitting tracks
     print("-" * 70)
     print("WORST FITTING TRACKS (lowest similarity to any seed)")
     print("-" * 70)
-    for r in results[:30]:
-        print(f"  {r['max_sim']:.4f} (avg: {r['avg_sim']:.4f}) | {r['name'][:55]}")
+    for i in range(min(30, len(names))):
+        print(f"  {max_sims[i]:.4f} (avg: {avg_sims[i]:.4f}) | {names[i][:55]}")
 
     # Best fitting tracks
     print("\n" + "-" * 70)
     print("BEST FITTING TRACKS (highest similarity to any seed)")
     print("-" * 70)
-    for r in results[-15:]:
-        print(f"  {r['max_sim']:.4f} (avg: {r['avg_sim']:.4f}) | {r['name'][:55]}")
+    for i in range(max(0, len(names) - 15), len(names)):
+        print(f"  {max_sims[i]:.4f} (avg: {avg_sims[i]:.4f}) | {names[i][:55]}")
 
     # Statistics
     print("\n" + "-" * 70)
     print("SIMILARITY STATISTICS")
     print("-" * 70)
-    max_sims = [r['max_sim'] for r in results]
-    avg_sims = [r['avg_sim'] for r in results]
+    q25, median, q75 = np.percentile(max_sims, [25, 50, 75])
 
     print(f"  Max similarity to any seed:")
-    print(f"    Min:    {min(max_sims):.4f}")
-    print(f"    25th:   {np.percentile(max_sims, 25):.4f}")
-    print(f"    Median: {np.median(max_sims):.4f}")
-    print(f"    75th:   {np.percentile(max_sims, 75):.4f}")
-    print(f"    Max:    {max(max_sims):.4f}")
+    print(f"    Min:    {max_sims.min():.4f}")
+    print(f"    25th:   {q25:.4f}")
+    print(f"    Median: {median:.4f}")
+    print(f"    75th:   {q75:.4f}")
+    print(f"    Max:    {max_sims.max():.4f}")
 
     print(f"\n  Average similarity to all seeds:")
-    print(f"    Min:    {min(avg_sims):.4f}")
+    print(f"    Min:    {avg_sims.min():.4f}")
     print(f"    Median: {np.median(avg_sims):.4f}")
-    print(f"    Max:    {max(avg_sims):.4f}")
+    print(f"    Max:    {avg_sims.max():.4f}")
 
     # Thresholds
     print("\n" + "-" * 70)
@@ -194,32 +201,26 @@ def main():
     print("-" * 70)
     thresholds = [0.90, 0.92, 0.94, 0.96, 0.98]
     for thresh in thresholds:
-        count = sum(1 for r in results if r['max_sim'] < thresh)
-        pct = count / len(results) * 100
+        count = np.count_nonzero(max_sims < thresh)
+        pct = count / len(max_sims) * 100
         print(f"  Below {thresh}: {count:3} tracks ({pct:5.1f}%)")
 
     # Artist distribution in low-similarity tracks
     print("\n" + "-" * 70)
     print("ARTIST BREAKDOWN IN LOW-SIMILARITY TRACKS (sim < 0.94)")
     print("-" * 70)
-    low_sim_artists = defaultdict(int)
-    for r in results:
-        if r['max_sim'] < 0.94:
-            low_sim_artists[r['artist']] += 1
+    low_sim_artists = Counter(artists[max_sims < 0.94].tolist())
 
-    for artist, count in sorted(low_sim_artists.items(), key=lambda x: -x[1])[:20]:
+    for artist, count in low_sim_artists.most_common(20):
         print(f"  {count:2} tracks: {artist[:50]}")
 
     # What artists are in high similarity range?
     print("\n" + "-" * 70)
     print("ARTIST BREAKDOWN IN HIGH-SIMILARITY TRACKS (sim >= 0.96)")
     print("-" * 70)
-    high_sim_artists = defaultdict(int)
-    for r in results:
-        if r['max_sim'] >= 0.96:
-            high_sim_artists[r['artist']] += 1
+    high_sim_artists = Counter(artists[max_sims >= 0.96].tolist())
 
-    for artist, count in sorted(high_sim_artists.items(), key=lambda x: -x[1])[:20]:
+    for artist, count in high_sim_artists.most_common(20):
         print(f"  {count:2} tracks: {artist[:50]}")
 
     # Compute what similarity threshold would be needed to exclude different artists
@@ -232,7 +233,7 @@ def main():
     print("\n Similarity distribution:")
     ranges = [(0.85, 0.90), (0.90, 0.92), (0.92, 0.94), (0.94, 0.96), (0.96, 0.98), (0.98, 1.0)]
     for low, high in ranges:
-        count = sum(1 for r in results if low <= r['max_sim'] < high)
+        count = np.count_nonzero((low <= max_sims) & (max_sims < high))
         print(f"  {low:.2f} - {high:.2f}: {count:3} tracks")
 
     # Find all $uicideboy$ tracks similarity to seeds
@@ -240,21 +241,13 @@ def main():
     print("$UICIDEBOY$ TRACKS IN LIBRARY (for comparison)")
     print("=" * 70)
 
-    sb_tracks_library = []
-    for tid, track in all_tracks.items():
-        if '$uicideboy$' in track['artist'].lower() or 'suicideboy' in track['artist'].lower():
-            if not any(s['id'] == tid for s in seeds):
-                sims = [cosine_similarity(track['embedding'], seed_emb) for seed_emb in seed_embeddings]
-                sb_tracks_library.append({
-                    'name': f"{track['artist']} - {track['title']}",
-                    'max_sim': max(sims),
-                    'avg_sim': np.mean(sims)
-                })
-
-    sb_tracks_library.sort(key=lambda x: x['max_sim'])
-    print(f"\nOther $uicideboy$ tracks (not seeds): {len(sb_tracks_library)}")
-    if sb_tracks_library:
-        print(f"  Similarity range: {sb_tracks_library[0]['max_sim']:.4f} - {sb_tracks_library[-1]['max_sim']:.4f}")
+    sb_ids = [tid for tid, track in all_tracks.items()
+              if tid not in seed_ids and is_suicideboys_track(track)]
+
+    print(f"\nOther $uicideboy$ tracks (not seeds): {len(sb_ids)}")
+    if sb_ids:
+        sb_max_sims = (seed_embeddings @ np.array([all_tracks[tid]['embedding'] for tid in sb_ids]).T).max(axis=0)
+        print(f"  Similarity range: {sb_max_sims.min():.4f} - {sb_max_sims.max():.4f}")
         print(f"  These should all be included in an ideal playlist!")
 
 
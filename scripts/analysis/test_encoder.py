@@ -3,24 +3,28 @@
 Test the audio encoder with real audio files to check if embeddings differ across genres.
 """
 
+import sys
 import numpy as np
 import torch
 import librosa
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-# Load the same model we exported
-from export_audio_encoder import AudioEncoder
-from huggingface_hub import hf_hub_download
+from _mel import power_to_unit_db, resize_frames
 
+from _loader import best_device, get_audio_encoder, load_audio_encoder
 
-def load_model():
-    """Load the audio encoder model with trained weights."""
-    model = AudioEncoder()
-    weights_path = hf_hub_download('teticio/audio-encoder', 'diffusion_pytorch_model.bin')
-    state_dict = torch.load(weights_path, map_location='cpu', weights_only=True)
-    model.load_state_dict(state_dict)
-    model.eval()
-    return model
+
+def load_model(use_compile=False):
+    """Load the audio encoder model with trained weights on best_device().
+
+    By default this is the shared frozen TorchScript encoder. With use_compile,
+    an eager copy is wrapped in torch.compile instead, specialized to the
+    static input shape; this pays off only when it is called repeatedly.
+    """
+    if not (use_compile and hasattr(torch, 'compile')):
+        return get_audio_encoder()
+    return torch.compile(load_audio_encoder(), fullgraph=True, dynamic=False)
 
 
 def preprocess_audio(audio_path: str, sr: int = 22050, n_mels: int = 96,
@@ -34,7 +38,7 @@ def preprocess_audio(audio_path: str, sr: int = 22050, n_mels: int = 96,
     2. Compute mel spectrogram
     3. Convert to dB (power_to_db with ref=max, top_db=80)
     4. Normalize to [0, 1]
-    5. Resize to target_frames
+    5. Resize to target_frames (on the backend's resize_spectrogram grid)
     """
     # Load audio
     y, sr = librosa.load(audio_path, sr=sr, mono=True)
@@ -44,25 +48,11 @@ def preprocess_audio(audio_path: str, sr: int = 22050, n_mels: int = 96,
         y=y, sr=sr, n_fft=n_fft, hop_length=hop_length, n_mels=n_mels
     )
 
-    # Convert to dB with ref=max, top_db=80
-    mel_spec_db = librosa.power_to_db(mel_spec, ref=np.max, top_db=top_db)
-
-    # Normalize to [0, 1]: (S + top_db) / top_db
-    mel_spec_norm = (mel_spec_db + top_db) / top_db
-
-    # Resize to target frames
-    from scipy.ndimage import zoom
-    current_frames = mel_spec_norm.shape[1]
-    if current_frames != target_frames:
-        scale = target_frames / current_frames
-        mel_spec_norm = zoom(mel_spec_norm, (1, scale), order=1)
+    # Convert to dB with ref=max, top_db=80 and normalize to [0, 1], in place
+    mel_spec_norm = power_to_unit_db(mel_spec, top_db)
 
-    # Ensure exact size
-    if mel_spec_norm.shape[1] > target_frames:
-        mel_spec_norm = mel_spec_norm[:, :target_frames]
-    elif mel_spec_norm.shape[1] < target_frames:
-        pad = target_frames - mel_spec_norm.shape[1]
-        mel_spec_norm = np.pad(mel_spec_norm, ((0, 0), (0, pad)), mode='constant')
+    # Resize to target frames (linear interpolation along the frame axis)
+    mel_spec_norm = resize_frames(mel_spec_norm, target_frames)
 
     # Convert to tensor with batch and channel dimensions
     tensor = torch.from_numpy(mel_spec_norm.astype(np.float32))
@@ -73,12 +63,12 @@ def preprocess_audio(audio_path: str, sr: int = 22050, n_mels: int = 96,
 
 def cosine_similarity(a, b):
     """Compute cosine similarity between two vectors."""
-    return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
+    return np.dot(a, b) / np.sqrt(np.vdot(a, a) * np.vdot(b, b))
 
 
 def main():
     print("Loading model...")
-    model = load_model()
+    model = load_model(use_compile='--compile' in sys.argv[1:])
 
     # Test files (from the library)
     library_path = Path("/Volumes/tank/navidrome/music")
@@ -96,25 +86,45 @@ def main():
 
     print(f"\nFound {len(audio_files)} audio files")
 
-    # Generate embeddings
+    audio_files = audio_files[:6]
+
+    # Decode and preprocess files concurrently (librosa.load releases the GIL
+    # while decoding); results are still consumed in file order
+    with ThreadPoolExecutor(max_workers=min(8, len(audio_files))) as pool:
+        futures = [pool.submit(preprocess_audio, str(audio_path)) for audio_path in audio_files]
+
+        # Collect mel spectrograms
+        names = []
+        mels = []
+        for audio_path, future in zip(audio_files, futures):
+            print(f"\nProcessing: {audio_path.name}")
+            try:
+                mel_tensor = future.result()
+                print(f"  Mel shape: {mel_tensor.shape}")
+                print(f"  Mel stats: min={mel_tensor.min():.4f}, max={mel_tensor.max():.4f}, mean={mel_tensor.mean():.4f}")
+
+                names.append(audio_path.name)
+                mels.append(mel_tensor)
+            except Exception as e:
+                print(f"  Error: {e}")
+
+    if not mels:
+        print("No audio files could be processed!")
+        return
+
+    # Generate embeddings for all files in a single batch on the model's device
+    batch = torch.cat(mels).contiguous(memory_format=torch.channels_last)
+    with torch.inference_mode():
+        batch = model(batch.to(best_device())).cpu().numpy().reshape(len(mels), -1)
+
     embeddings = []
-    for audio_path in audio_files[:6]:
-        print(f"\nProcessing: {audio_path.name}")
-        try:
-            mel_tensor = preprocess_audio(str(audio_path))
-            print(f"  Mel shape: {mel_tensor.shape}")
-            print(f"  Mel stats: min={mel_tensor.min():.4f}, max={mel_tensor.max():.4f}, mean={mel_tensor.mean():.4f}")
-
-            with torch.no_grad():
-                embedding = model(mel_tensor).numpy().flatten()
-
-            print(f"  Embedding shape: {embedding.shape}")
-            print(f"  Embedding stats: min={embedding.min():.4f}, max={embedding.max():.4f}, mean={embedding.mean():.4f}")
-            print(f"  First 5 values: {embedding[:5]}")
-
-            embeddings.append((audio_path.name, embedding))
-        except Exception as e:
-            print(f"  Error: {e}")
+    for name, embedding in zip(names, batch):
+        print(f"\nEmbedding: {name}")
+        print(f"  Embedding shape: {embedding.shape}")
+        print(f"  Embedding stats: min={embedding.min():.4f}, max={embedding.max():.4f}, mean={embedding.mean():.4f}")
+        print(f"  First 5 values: {embedding[:5]}")
+
+        embeddings.append((name, embedding))
 
     # Compute pairwise similarities
     print("\n" + "="*60)
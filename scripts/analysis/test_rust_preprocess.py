@@ -6,7 +6,10 @@ This creates test files that we can compare.
 
 import numpy as np
 import librosa
-from scipy.ndimage import zoom
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from _mel import power_to_unit_db, resize_frames
 
 
 def preprocess_audio_python(audio_path: str, sr: int = 22050, n_mels: int = 96,
@@ -24,26 +27,19 @@ def preprocess_audio_python(audio_path: str, sr: int = 22050, n_mels: int = 96,
         y=y, sr=sr, n_fft=n_fft, hop_length=hop_length, n_mels=n_mels
     )
 
-    # Convert to dB with ref=max, top_db=80
-    mel_spec_db = librosa.power_to_db(mel_spec, ref=np.max, top_db=top_db)
-
-    # Normalize to [0, 1]: (S + top_db) / top_db
-    mel_spec_norm = (mel_spec_db + top_db) / top_db
+    # Convert to dB with ref=max, top_db=80 and normalize to [0, 1], in place
+    mel_spec_norm = power_to_unit_db(mel_spec, top_db)
 
-    # Resize to target frames
-    current_frames = mel_spec_norm.shape[1]
-    if current_frames != target_frames:
-        scale = target_frames / current_frames
-        mel_spec_norm = zoom(mel_spec_norm, (1, scale), order=1)
+    # Resize to target frames (linear interpolation along the frame axis)
+    return resize_frames(mel_spec_norm, target_frames)
 
-    # Ensure exact size
-    if mel_spec_norm.shape[1] > target_frames:
-        mel_spec_norm = mel_spec_norm[:, :target_frames]
-    elif mel_spec_norm.shape[1] < target_frames:
-        pad = target_frames - mel_spec_norm.shape[1]
-        mel_spec_norm = np.pad(mel_spec_norm, ((0, 0), (0, pad)), mode='constant')
 
-    return mel_spec_norm
+@lru_cache(maxsize=None)
+def sample_phase(n_samples: int, sample_rate: int):
+    """2*pi*t at each sample time, shared (read-only) by every tone of the same length."""
+    two_pi_t = (2 * np.pi / sample_rate) * np.arange(n_samples)
+    two_pi_t.flags.writeable = False
+    return two_pi_t
 
 
 def create_synthetic_audio_file(output_path: str, duration_secs: float = 6.0,
@@ -54,18 +50,18 @@ def create_synthetic_audio_file(output_path: str, duration_secs: float = 6.0,
     import scipy.io.wavfile as wav
 
     n_samples = int(duration_secs * sample_rate)
-    t = np.linspace(0, duration_secs, n_samples)
 
     if pattern == "sweep":
-        # Frequency sweep from 100 Hz to 8000 Hz
-        freq = 100 + 7900 * t / duration_secs
-        audio = 0.5 * np.sin(2 * np.pi * freq * t)
+        # Frequency sweep from 100 Hz to 8000 Hz; the phase is the running
+        # sum of the instantaneous frequency
+        freq = 100 + 7900 * np.arange(n_samples) / n_samples
+        audio = 0.5 * np.sin(np.cumsum(freq * (2 * np.pi / sample_rate)))
     elif pattern == "tone_440":
         # Pure 440 Hz tone
-        audio = 0.5 * np.sin(2 * np.pi * 440 * t)
+        audio = 0.5 * np.sin(440 * sample_phase(n_samples, sample_rate))
     elif pattern == "tone_220":
         # Pure 220 Hz tone
-        audio = 0.5 * np.sin(2 * np.pi * 220 * t)
+        audio = 0.5 * np.sin(220 * sample_phase(n_samples, sample_rate))
     elif pattern == "noise":
         # White noise
         audio = 0.3 * np.random.randn(n_samples)
@@ -76,7 +72,7 @@ def create_synthetic_audio_file(output_path: str, duration_secs: float = 6.0,
         raise ValueError(f"Unknown pattern: {pattern}")
 
     # Convert to 16-bit
-    audio_int16 = (audio * 32767).astype(np.int16)
+    audio_int16 = np.rint(audio * 32767).astype(np.int16)
     wav.write(output_path, sample_rate, audio_int16)
     print(f"Created {output_path} ({pattern})")
 
@@ -89,19 +85,20 @@ def main():
     test_dir = tempfile.mkdtemp()
     patterns = ["sweep", "tone_440", "tone_220", "noise", "silence"]
 
-    audio_files = []
-    for pattern in patterns:
-        path = os.path.join(test_dir, f"test_{pattern}.wav")
-        create_synthetic_audio_file(path, pattern=pattern)
-        audio_files.append((pattern, path))
+    audio_files = [(pattern, os.path.join(test_dir, f"test_{pattern}.wav")) for pattern in patterns]
+
+    # Synthesize/write the files, then preprocess them, concurrently (numpy,
+    # file I/O and librosa's decoding release the GIL); results stay in order
+    with ThreadPoolExecutor(max_workers=min(len(audio_files), os.cpu_count() or 1)) as pool:
+        list(pool.map(lambda item: create_synthetic_audio_file(item[1], pattern=item[0]), audio_files))
+        mels = list(pool.map(preprocess_audio_python, [path for _, path in audio_files]))
 
     print("\n" + "="*70)
     print("Python librosa preprocessing results:")
     print("="*70)
 
     mel_specs = []
-    for pattern, path in audio_files:
-        mel = preprocess_audio_python(path)
+    for (pattern, path), mel in zip(audio_files, mels):
         mel_specs.append((pattern, mel))
         print(f"\n{pattern}:")
         print(f"  Shape: {mel.shape}")
@@ -126,25 +123,21 @@ def main():
     print("="*70)
 
     import torch
-    from export_audio_encoder import AudioEncoder
-    from huggingface_hub import hf_hub_download
+    from _loader import best_device, get_audio_encoder
 
-    model = AudioEncoder()
-    weights_path = hf_hub_download('teticio/audio-encoder', 'diffusion_pytorch_model.bin')
-    state_dict = torch.load(weights_path, map_location='cpu', weights_only=True)
-    model.load_state_dict(state_dict)
-    model.eval()
+    model = get_audio_encoder()
 
-    embeddings = []
-    for pattern, mel in mel_specs:
-        # Convert to tensor with batch and channel dims
-        tensor = torch.from_numpy(mel.astype(np.float32))
-        tensor = tensor.unsqueeze(0).unsqueeze(0)  # (1, 1, 96, 216)
+    # One (n_patterns, 100) matrix, filled row by row
+    embeddings = np.empty((len(mel_specs), 100), dtype=np.float32)
+    # One (1, 1, 96, 216) input buffer, refilled for each mel
+    tensor = torch.empty(1, 1, 96, 216).contiguous(memory_format=torch.channels_last)
+    for row, (pattern, mel) in enumerate(mel_specs):
+        tensor[0, 0].copy_(torch.from_numpy(mel))
 
         with torch.no_grad():
-            embedding = model(tensor).numpy().flatten()
+            embeddings[row] = model(tensor.to(best_device())).cpu().numpy().flatten()
+        embedding = embeddings[row]
 
-        embeddings.append((pattern, embedding))
         print(f"\n{pattern}:")
         print(f"  Embedding shape: {embedding.shape}")
         print(f"  Embedding norm: {np.linalg.norm(embedding):.4f}")
@@ -155,15 +148,11 @@ def main():
     print("Pairwise Cosine Similarities (from librosa mel specs):")
     print("="*70)
 
-    def cosine_similarity(a, b):
-        return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b) + 1e-10)
-
-    for i in range(len(embeddings)):
-        for j in range(i+1, len(embeddings)):
-            name1, emb1 = embeddings[i]
-            name2, emb2 = embeddings[j]
-            sim = cosine_similarity(emb1, emb2)
-            print(f"{name1:15} vs {name2:15}: {sim:.4f}")
+    # All pairs at once: normalize the rows, one matmul, read the upper triangle
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-10
+    iu = np.triu_indices(len(embeddings), k=1)
+    for i, j, sim in zip(iu[0], iu[1], (embeddings @ embeddings.T)[iu]):
+        print(f"{mel_specs[i][0]:15} vs {mel_specs[j][0]:15}: {sim:.4f}")
 
     # Cleanup
     import shutil
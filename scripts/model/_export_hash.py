@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Up-to-date check shared by the ONNX export scripts.
+
+An export records a hash of its inputs next to every file it writes, in
+`<artifact>.hash`; a later run with the same inputs can skip re-exporting
+as long as all of those files are still there.
+"""
+
+import hashlib
+from pathlib import Path
+
+
+def export_key(weights_path, script_path, **options):
+    """sha256 of the weights file, the exporting script and its options."""
+    digest = hashlib.sha256()
+    for path in (weights_path, script_path):
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    digest.update(repr(sorted(options.items())).encode())
+    return digest.hexdigest()
+
+
+def _hash_path(output_path):
+    return Path(f"{output_path}.hash")
+
+
+def is_up_to_date(paths, key):
+    """Whether every file in `paths` exists and was exported from inputs hashing to `key`."""
+    for path in paths:
+        hash_path = _hash_path(path)
+        if not (Path(path).exists() and hash_path.exists() and hash_path.read_text() == key):
+            return False
+    return True
+
+
+def record_export(paths, key):
+    """Mark every file in `paths` as exported from inputs hashing to `key`."""
+    for path in paths:
+        _hash_path(path).write_text(key)
+
+
+def clear_export(output_path):
+    """Forget the recorded inputs of `output_path`, e.g. after overwriting it."""
+    _hash_path(output_path).unlink(missing_ok=True)
@@ -8,13 +8,16 @@ Requirements:
     pip install torch transformers diffusers onnx
 
 Usage:
-    python convert_to_onnx.py
+    python convert_to_onnx.py           # skips the export if already up-to-date
+    python convert_to_onnx.py --force   # re-export regardless
 """
 
 import torch
 import torch.nn as nn
 import os
 
+from _export_hash import clear_export, export_key, is_up_to_date, record_export
+
 # The audio encoder architecture from Deej-AI
 # Based on: https://github.com/teticio/Deej-AI
 
@@ -58,7 +61,7 @@ class AudioEncoder(nn.Module):
         return x
 
 
-def download_and_convert():
+def download_and_convert(force=False):
     """Download from HuggingFace and convert to ONNX"""
     from huggingface_hub import hf_hub_download
 
@@ -70,6 +73,14 @@ def download_and_convert():
 
     print(f"Model downloaded to: {model_path}")
 
+    output_path = os.path.join(os.path.dirname(__file__), "audio_encoder.onnx")
+
+    # Skip the conversion when the weights and this script are unchanged
+    key = export_key(model_path, __file__)
+    if not force and is_up_to_date([output_path], key):
+        print(f"{output_path} is up-to-date, skipping export (pass --force to re-export)")
+        return output_path
+
     # Load the state dict
     state_dict = torch.load(model_path, map_location='cpu')
     print(f"State dict keys: {state_dict.keys()}")
@@ -92,23 +103,23 @@ def download_and_convert():
     # For 5 seconds at 22050Hz with hop_length=512: frames = 22050*5/512 ≈ 216
     dummy_input = torch.randn(1, 1, 128, 216)
 
-    output_path = os.path.join(os.path.dirname(__file__), "audio_encoder.onnx")
-
     print(f"Exporting to ONNX: {output_path}")
-    torch.onnx.export(
-        model,
-        dummy_input,
-        output_path,
-        export_params=True,
-        opset_version=14,
-        do_constant_folding=True,
-        input_names=['input'],
-        output_names=['output'],
-        dynamic_axes={
-            'input': {0: 'batch_size', 3: 'n_frames'},
-            'output': {0: 'batch_size'}
-        }
-    )
+    # No autograd bookkeeping while tracing the graph
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            dummy_input,
+            output_path,
+            export_params=True,
+            opset_version=14,
+            do_constant_folding=True,
+            input_names=['input'],
+            output_names=['output'],
+            dynamic_axes={
+                'input': {0: 'batch_size', 3: 'n_frames'},
+                'output': {0: 'batch_size'}
+            }
+        )
 
     print(f"ONNX model saved to: {output_path}")
 
@@ -118,6 +129,8 @@ def download_and_convert():
     onnx.checker.check_model(onnx_model)
     print("ONNX model verification passed!")
 
+    record_export([output_path], key)
+
     return output_path
 
 
@@ -133,24 +146,28 @@ def create_simple_encoder():
 
     output_path = os.path.join(os.path.dirname(__file__), "audio_encoder.onnx")
 
+    # This overwrites any trained export, so it is no longer up-to-date
+    clear_export(output_path)
+
     print(f"Exporting to ONNX: {output_path}")
 
     # Use the legacy export API for compatibility
-    torch.onnx.export(
-        model,
-        dummy_input,
-        output_path,
-        export_params=True,
-        opset_version=14,
-        do_constant_folding=True,
-        input_names=['input'],
-        output_names=['output'],
-        dynamic_axes={
-            'input': {0: 'batch_size', 3: 'n_frames'},
-            'output': {0: 'batch_size'}
-        },
-        dynamo=False  # Use legacy export
-    )
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            dummy_input,
+            output_path,
+            export_params=True,
+            opset_version=14,
+            do_constant_folding=True,
+            input_names=['input'],
+            output_names=['output'],
+            dynamic_axes={
+                'input': {0: 'batch_size', 3: 'n_frames'},
+                'output': {0: 'batch_size'}
+            },
+            dynamo=False  # Use legacy export
+        )
 
     print(f"ONNX model saved to: {output_path}")
     print("Note: This model has random weights. For production, use the trained weights.")
@@ -165,7 +182,7 @@ if __name__ == "__main__":
         create_simple_encoder()
     else:
         try:
-            download_and_convert()
+            download_and_convert(force='--force' in sys.argv[1:])
         except Exception as e:
             print(f"Full conversion failed: {e}")
             print("\nFalling back to simple encoder for testing...")
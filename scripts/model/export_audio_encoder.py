@@ -13,10 +13,14 @@ Architecture uses:
 - Final embedding layer (1024 → 100)
 """
 
+import argparse
+
 import torch
 import torch.nn as nn
 from huggingface_hub import hf_hub_download
 
+from _export_hash import export_key, is_up_to_date, record_export
+
 
 class SeparableConv2d(nn.Module):
     """Depthwise separable convolution."""
@@ -66,6 +70,11 @@ class DenseBlock(nn.Module):
         return x
 
 
+# After 3 maxpools on 96x216: 12x27x128 = 41472 features into the dense block
+DENSE_IN_FEATURES = 41472
+DENSE_OUT_FEATURES = 1024
+
+
 class AudioEncoder(nn.Module):
     """
     AudioEncoder from teticio/audio-encoder.
@@ -83,8 +92,8 @@ class AudioEncoder(nn.Module):
 
         # After 3 maxpools on 96x216: 12x27x128 = 41472
         self.flatten = nn.Flatten()
-        self.dense_block = DenseBlock(41472, 1024)
-        self.embedding = nn.Linear(1024, 100)
+        self.dense_block = DenseBlock(DENSE_IN_FEATURES, DENSE_OUT_FEATURES)
+        self.embedding = nn.Linear(DENSE_OUT_FEATURES, 100)
 
     def forward(self, x):
         for conv_block in self.conv_blocks:
@@ -95,14 +104,161 @@ class AudioEncoder(nn.Module):
         return x
 
 
+def fold_batch_norms(model):
+    """
+    Fold each eval-mode BatchNorm into the layer before it (the pointwise conv
+    of each ConvBlock, the Linear of the DenseBlock) and replace it with an
+    Identity, so the exported graph has no BatchNorm ops.
+    """
+    from torch.nn.utils.fusion import fuse_conv_bn_eval, fuse_linear_bn_eval
+
+    for block in model.conv_blocks:
+        block.sep_conv.pointwise = fuse_conv_bn_eval(block.sep_conv.pointwise, block.batch_norm)
+        block.batch_norm = nn.Identity()
+
+    dense_block = model.dense_block
+    dense_block.dense = fuse_linear_bn_eval(dense_block.dense, dense_block.batch_norm)
+    dense_block.batch_norm = nn.Identity()
+    return model
+
+
+def factorize_dense(model, rank):
+    """
+    Replace the 41472→1024 dense Linear with a rank-`rank` truncated SVD
+    factorization: Linear(41472→rank, no bias) followed by Linear(rank→1024).
+    """
+    dense = model.dense_block.dense
+    with torch.no_grad():
+        U, S, Vh = torch.linalg.svd(dense.weight, full_matrices=False)
+        project = nn.Linear(dense.in_features, rank, bias=False)
+        project.weight.copy_(Vh[:rank])
+        expand = nn.Linear(rank, dense.out_features)
+        expand.weight.copy_(U[:, :rank] * S[:rank])
+        expand.bias.copy_(dense.bias)
+    model.dense_block.dense = nn.Sequential(project, expand)
+    return model
+
+
+def min_cosine_similarity(output, reference):
+    """Smallest row-wise cosine similarity between two (batch, dim) embedding arrays."""
+    import numpy as np
+    output = output / np.linalg.norm(output, axis=1, keepdims=True)
+    reference = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    return (output * reference).sum(axis=1).min()
+
+
+def reduced_precision_paths(fp32_path):
+    """The (FP16, INT8) variant paths export_reduced_precision writes for `fp32_path`."""
+    return fp32_path.replace(".onnx", "_fp16.onnx"), fp32_path.replace(".onnx", "_int8.onnx")
+
+
+def export_reduced_precision(model, fp32_path):
+    """
+    Write FP16 and INT8 (dynamically quantized Linear layers) variants of the
+    ONNX model next to it, checking their embeddings against PyTorch.
+    Returns the paths written.
+    """
+    import onnx
+
+    fp16_path, int8_path = reduced_precision_paths(fp32_path)
+    variants = []
+    try:
+        from onnxconverter_common import float16
+    except ImportError:
+        print("onnxconverter-common not installed, skipping FP16 export")
+    else:
+        # Keep float32 inputs/outputs so callers feed the same tensors
+        onnx.save(float16.convert_float_to_float16(onnx.load(fp32_path), keep_io_types=True), fp16_path)
+        variants.append(fp16_path)
+
+    try:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+    except ImportError:
+        print("onnxruntime not installed, skipping INT8 export and verification")
+        return variants
+    quantize_dynamic(fp32_path, int8_path, op_types_to_quantize=["MatMul", "Gemm"],
+                     weight_type=QuantType.QInt8)
+    variants.append(int8_path)
+
+    # Compare against the FP32 PyTorch embeddings on a batch of mel-range inputs
+    import onnxruntime as ort
+    calibration = torch.rand(8, 1, 96, 216)
+    with torch.no_grad():
+        reference = model(calibration).numpy()
+
+    for path in variants:
+        session = ort.InferenceSession(path, providers=["CPUExecutionProvider"])
+        output = session.run(None, {"mel_spectrogram": calibration.numpy()})[0]
+        min_sim = min_cosine_similarity(output, reference)
+        status = "OK" if min_sim >= 0.999 else "WARNING: below 0.999, do not use"
+        print(f"  {path}: min cosine similarity vs FP32 {min_sim:.5f} ({status})")
+    return variants
+
+
+def verify_static_export(static_path, dynamic_path):
+    """
+    Run the static-shape model through onnxruntime one input at a time and
+    compare its embeddings against the dynamic-shape model's.
+    """
+    import numpy as np
+    try:
+        import onnxruntime as ort
+    except ImportError:
+        print("onnxruntime not installed, skipping static model verification")
+        return
+    calibration = torch.rand(8, 1, 96, 216).numpy()
+    dynamic = ort.InferenceSession(dynamic_path, providers=["CPUExecutionProvider"])
+    reference = dynamic.run(None, {"mel_spectrogram": calibration})[0]
+    static = ort.InferenceSession(static_path, providers=["CPUExecutionProvider"])
+    output = np.concatenate([static.run(None, {"mel_spectrogram": calibration[i:i + 1]})[0]
+                             for i in range(len(calibration))])
+    min_sim = min_cosine_similarity(output, reference)
+    status = "OK" if min_sim >= 0.999 else "WARNING: below 0.999, do not use"
+    print(f"  {static_path}: min cosine similarity vs dynamic {min_sim:.5f} ({status})")
+
+
+def svd_rank_arg(value):
+    """argparse type for --svd-rank: an integer in [1, min(dense weight shape))."""
+    max_rank = min(DENSE_IN_FEATURES, DENSE_OUT_FEATURES)
+    try:
+        rank = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"rank must be an integer, got {value!r}")
+    if not 1 <= rank < max_rank:
+        raise argparse.ArgumentTypeError(f"rank must be between 1 and {max_rank - 1}, got {rank}")
+    return rank
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Export the teticio/audio-encoder model to ONNX.")
+    parser.add_argument("--svd-rank", type=svd_rank_arg, metavar="K",
+                        help="replace the 41472x1024 dense layer with a rank-K SVD factorization")
+    parser.add_argument("--force", action="store_true",
+                        help="re-export even if the existing export is up-to-date")
+    return parser.parse_args()
+
+
 def main():
-    print("Creating AudioEncoder model...")
-    model = AudioEncoder()
+    args = parse_args()
+    svd_rank = args.svd_rank
+    suffix = f"_svd{svd_rank}" if svd_rank else ""
+    output_path = f"models/audio_encoder_correct{suffix}.onnx"
+    static_path = f"models/audio_encoder_static_1x1x96x216{suffix}.onnx"
+    artifacts = [output_path, static_path, *reduced_precision_paths(output_path)]
 
     print("Downloading weights from HuggingFace...")
     weights_path = hf_hub_download('teticio/audio-encoder', 'diffusion_pytorch_model.bin')
     print(f"Downloaded to: {weights_path}")
 
+    # Skip the whole export when nothing it depends on has changed (--force to redo)
+    key = export_key(weights_path, __file__, svd_rank=svd_rank)
+    if not args.force and is_up_to_date(artifacts, key):
+        print(f"{', '.join(artifacts)} are up-to-date, skipping export (pass --force to re-export)")
+        return
+
+    print("Creating AudioEncoder model...")
+    model = AudioEncoder()
+
     state_dict = torch.load(weights_path, map_location='cpu', weights_only=True)
 
     print("Loading weights...")
@@ -120,24 +276,40 @@ def main():
     print(f"Output shape: {output.shape}")
     print(f"Output sample: {output[0, :5].tolist()}")
 
+    print("\nFolding BatchNorm layers into the preceding conv/linear layers...")
+    fold_batch_norms(model)
+    with torch.no_grad():
+        folded_output = model(dummy_input)
+    print(f"Max abs difference after folding: {(folded_output - output).abs().max().item():.2e}")
+
+    if svd_rank:
+        print(f"\nFactorizing the dense layer to rank {svd_rank}...")
+        test_batch = torch.rand(8, 1, 96, 216)
+        with torch.no_grad():
+            reference = model(test_batch)
+            factorize_dense(model, svd_rank)
+            factorized = model(test_batch)
+        min_sim = torch.nn.functional.cosine_similarity(factorized, reference, dim=1).min().item()
+        print(f"Min cosine similarity vs full rank on a test batch: {min_sim:.5f}")
+
     # Export to ONNX using legacy JIT export (more compatible)
-    output_path = "models/audio_encoder_correct.onnx"
     print(f"\nExporting to {output_path}...")
 
-    # Use the legacy export path
-    torch.onnx.export(
-        model,
-        dummy_input,
-        output_path,
-        input_names=["mel_spectrogram"],
-        output_names=["embedding"],
-        dynamic_axes={
-            "mel_spectrogram": {0: "batch_size"},
-            "embedding": {0: "batch_size"}
-        },
-        opset_version=14,
-        dynamo=False  # Use legacy JIT export
-    )
+    # Use the legacy export path, without autograd bookkeeping while tracing
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            dummy_input,
+            output_path,
+            input_names=["mel_spectrogram"],
+            output_names=["embedding"],
+            dynamic_axes={
+                "mel_spectrogram": {0: "batch_size"},
+                "embedding": {0: "batch_size"}
+            },
+            opset_version=14,
+            dynamo=False  # Use legacy JIT export
+        )
 
     print(f"Successfully exported to {output_path}")
 
@@ -161,7 +333,47 @@ def main():
     # Skip ONNX runtime verification (not available for Python 3.14)
     # The Rust code will use the ort crate for inference
 
-    print("\n✓ Export complete! New model ready at models/audio_encoder_correct.onnx")
+    # The backend only ever runs single (1, 1, 96, 216) inputs, so also export a
+    # fully static graph: no shape ops left for the runtime to resolve
+    print(f"\nExporting static-shape model to {static_path}...")
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            dummy_input,
+            static_path,
+            input_names=["mel_spectrogram"],
+            output_names=["embedding"],
+            opset_version=14,
+            do_constant_folding=True,
+            dynamo=False
+        )
+
+    static_model = onnx.load(static_path)
+    try:
+        import onnxsim
+    except ImportError:
+        print("onnxsim not installed, skipping graph simplification")
+    else:
+        simplified, ok = onnxsim.simplify(static_model)
+        if ok:
+            static_model = simplified
+            onnx.save(static_model, static_path)
+            print("Simplified static graph with onnxsim")
+        else:
+            print("onnxsim could not validate the simplified graph, keeping the original")
+    onnx.checker.check_model(static_model)
+    print(f"Static model: {len(static_model.graph.node)} nodes (dynamic: {len(onnx_model.graph.node)})")
+    verify_static_export(static_path, output_path)
+
+    print("\nExporting reduced-precision variants...")
+    variants = export_reduced_precision(model, output_path)
+
+    # Only what was actually written is recorded, so a run missing an optional
+    # dependency is not treated as up-to-date next time
+    record_export([output_path, static_path, *variants], key)
+
+    print(f"\n✓ Export complete! New model ready at {output_path}")
+    print(f"  Static-shape variant at {static_path}")
 
 
 if __name__ == "__main__":